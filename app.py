@@ -1,42 +1,255 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, abort, send_from_directory
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Blueprint, current_app, stream_with_context, make_response, render_template, request, redirect, url_for, flash, session, abort, send_from_directory, send_file, jsonify, Response, g
+from flask import before_render_template, template_rendered, has_request_context
+from werkzeug.local import LocalProxy
+from markupsafe import Markup
 from werkzeug.utils import secure_filename
 from functools import wraps
-from datetime import datetime
-from pymongo import MongoClient
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from pymongo import MongoClient, InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from bson.objectid import ObjectId
+from bson import json_util
+from expiry import sweep_expired_groups, ExpirySweeper
+from indexes import ensure_indexes, coverage_report
+from pubsub import create_broker
+from recent import create_recent_messages
+from ratelimit import create_rate_limiter, per_minute, Bucket, RateLimited
+from facets import SubjectFacetCache
+from cache import TTLCache
+from storage import store_upload, release_blobs, collect_garbage, blob_path, blob_relpath
+from teardown import teardown_groups
+from archive import archive_messages, archived_before
+from transfer import export_group, import_group, gzip_chunks, open_export, ExportFormatError
+from hashing import PasswordHasher, HasherBusy, benchmark as benchmark_hashing
+from metrics import Registry, MongoCommandMetrics, COUNT_BUCKETS
+from database import MongoConnection, LazyDatabase, read_preference
+from compression import compress_response
+import search as text_search
+import groupstats as group_stats
+from membership import (add_member, remove_member, is_member, list_members, members_among, groups_among,
+                        user_memberships, migrate_embedded_members)
+import click
+import hashlib
+import json
+import logging
 import os
+import re
+import time
 
-# Initialize Flask app
-app = Flask(__name__, static_url_path='', static_folder='static')
-
-# Secret key
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+bp = Blueprint('main', __name__, cli_group=None)
 
 # File upload configuration
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'txt'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+# Attachments are content-named, so browsers may cache them for a year
+ATTACHMENT_MAX_AGE = 365 * 24 * 60 * 60
+ATTACHMENT_NAME = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]+)$')
+
+MAX_CHAT_PAGE_SIZE = 200
+
+# Fragments are keyed by version; the TTL only lets idle entries go
+FRAGMENT_CACHE_TTL = 24 * 60 * 60
+
+# Seconds between keep-alive comments on idle chat streams
+CHAT_STREAM_HEARTBEAT = 15
+
+
+def default_config():
+    """Settings read from the environment. create_app() applies its overrides on top."""
+    return {
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'your-secret-key-here'),
+        'UPLOAD_FOLDER': UPLOAD_FOLDER,
+        'MAX_CONTENT_LENGTH': MAX_FILE_SIZE,
+
+        # MongoDB. Each worker process opens its own pool on first use (see
+        # database.py); size it to the worker's thread count plus headroom.
+        'MONGO_URI': os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'),
+        # Tests and benchmark.py swap in mongomock.MongoClient
+        'MONGO_CLIENT_CLASS': MongoClient,
+        'MONGO_DBNAME': os.environ.get('MONGO_DBNAME', 'final_project_db'),
+        'MONGO_MAX_POOL_SIZE': int(os.environ.get('MONGO_MAX_POOL_SIZE', 50)),
+        'MONGO_MIN_POOL_SIZE': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+        'MONGO_CONNECT_TIMEOUT_MS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+        # Fail a request after this long without a reachable server (pymongo waits 30s)
+        'MONGO_SERVER_SELECTION_TIMEOUT_MS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        # Longest a request waits for a free pooled connection; unset waits indefinitely
+        'MONGO_WAIT_QUEUE_TIMEOUT_MS': int(os.environ['MONGO_WAIT_QUEUE_TIMEOUT_MS'])
+        if os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS') else None,
+        'MONGO_MAX_IDLE_TIME_MS': int(os.environ['MONGO_MAX_IDLE_TIME_MS'])
+        if os.environ.get('MONGO_MAX_IDLE_TIME_MS') else None,
+        # Wire compression, e.g. 'zstd,snappy,zlib' (zstd and snappy need extra packages)
+        'MONGO_COMPRESSORS': os.environ.get('MONGO_COMPRESSORS', ''),
+        # Where lag-tolerant reads go (listings, chat history, search, exports):
+        # 'primary' (default), 'primaryPreferred', 'secondaryPreferred', 'secondary'
+        # or 'nearest', skipping secondaries more than READ_MAX_STALENESS_S behind
+        # (at least 90; -1 for no bound). Needs a replica set. Users still read
+        # their own writes: see request_session().
+        'READ_PREFERENCE': os.environ.get('READ_PREFERENCE', 'primary'),
+        'READ_MAX_STALENESS_S': int(os.environ.get('READ_MAX_STALENESS_S', 90)),
+
+        # Behind nginx, set to an internal location aliased to the upload folder
+        # (e.g. /_uploads/) to hand file transfer off with X-Accel-Redirect.
+        # USE_X_SENDFILE=1 does the same for Apache/lighttpd.
+        'ATTACHMENT_ACCEL_REDIRECT': os.environ.get('ATTACHMENT_ACCEL_REDIRECT'),
+        'USE_X_SENDFILE': os.environ.get('USE_X_SENDFILE') == '1',
+
+        # Password hashing runs on a small bounded pool (see hashing.py). Changing
+        # PASSWORD_HASH_METHOD rehashes each user's password at their next login.
+        # HASH_WORKERS is per process: N workers hash up to N x HASH_WORKERS
+        # passwords at once (scrypt: ~32 MB each), so gunicorn.conf.py defaults
+        # it to the CPU count divided by the number of workers.
+        'PASSWORD_HASH_METHOD': os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'),
+        'HASH_WORKERS': int(os.environ.get('HASH_WORKERS', os.cpu_count() or 2)),
+        'HASH_QUEUE_SIZE': int(os.environ.get('HASH_QUEUE_SIZE', 16)),
+
+        # Chat history is loaded one page at a time
+        'CHAT_PAGE_SIZE': int(os.environ.get('CHAT_PAGE_SIZE', 50)),
+        # Messages older than this move to compressed bundles (see archive.py)
+        'ARCHIVE_AFTER_DAYS': int(os.environ.get('ARCHIVE_AFTER_DAYS', 180)),
+
+        # Live chat fan-out: 'poll' (any mongod, any number of workers; up to a
+        # second of delay), 'changestream' (replica set) or 'memory' (a single
+        # worker process only). See pubsub.py.
+        'CHAT_BROKER': os.environ.get('CHAT_BROKER', 'poll'),
+
+        # Newest messages of each group kept for the chat page (see recent.py):
+        # 'memory' (per worker; only with a changestream or poll broker, else
+        # it is turned off), 'redis' (shared, needs REDIS_URL) or 'off'. A
+        # memory buffer is refilled RECENT_MESSAGES_TTL seconds after its last fill.
+        'RECENT_MESSAGES': os.environ.get('RECENT_MESSAGES', 'memory'),
+        'RECENT_MESSAGES_PER_GROUP': int(os.environ.get('RECENT_MESSAGES_PER_GROUP', 100)),
+        'RECENT_MESSAGES_MAX_MB': int(os.environ.get('RECENT_MESSAGES_MAX_MB', 32)),
+        'RECENT_MESSAGES_TTL': int(os.environ.get('RECENT_MESSAGES_TTL', 30)),
+        'REDIS_URL': os.environ.get('REDIS_URL'),
+
+        # Chat post limits (see ratelimit.py): token buckets per poster, group and
+        # client IP, a byte budget for uploads and caps on concurrent uploads.
+        # RATE_LIMITS is 'memory' (per worker), 'redis' (shared, needs REDIS_URL)
+        # or 'off'. A limit of 0 disables it.
+        'RATE_LIMITS': os.environ.get('RATE_LIMITS', 'memory'),
+        'CHAT_POSTS_PER_MINUTE': int(os.environ.get('CHAT_POSTS_PER_MINUTE', 30)),
+        'CHAT_POSTS_PER_MINUTE_GROUP': int(os.environ.get('CHAT_POSTS_PER_MINUTE_GROUP', 300)),
+        'CHAT_POSTS_PER_MINUTE_IP': int(os.environ.get('CHAT_POSTS_PER_MINUTE_IP', 120)),
+        'UPLOAD_MB_PER_HOUR': int(os.environ.get('UPLOAD_MB_PER_HOUR', 200)),
+        'UPLOADS_PER_USER': int(os.environ.get('UPLOADS_PER_USER', 2)),
+        'UPLOADS_CONCURRENT': int(os.environ.get('UPLOADS_CONCURRENT', 8)),
+
+        # Groups shown per home page
+        'GROUPS_PAGE_SIZE': int(os.environ.get('GROUPS_PAGE_SIZE', 24)),
+
+        # Group documents cached for authorization checks (see get_group())
+        'GROUP_CACHE_SIZE': int(os.environ.get('GROUP_CACHE_SIZE', 1024)),
+        'GROUP_CACHE_TTL': int(os.environ.get('GROUP_CACHE_TTL', 30)),
+
+        # Rendered group cards and task rows (see render_fragment()); 0 disables
+        'FRAGMENT_CACHE_SIZE': int(os.environ.get('FRAGMENT_CACHE_SIZE', 4096)),
+
+        # gzip/brotli for responses of at least COMPRESS_MIN_SIZE bytes (see
+        # compression.py). Turn off when a proxy in front already compresses.
+        'COMPRESS_RESPONSES': os.environ.get('COMPRESS_RESPONSES', '1') == '1',
+        'COMPRESS_MIN_SIZE': int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),
+        'COMPRESS_LEVEL': int(os.environ.get('COMPRESS_LEVEL', 6)),
+        'BROTLI_QUALITY': int(os.environ.get('BROTLI_QUALITY', 4)),
+
+        # Request, template, upload, hashing and MongoDB timings, served at /metrics
+        # (see metrics.py). METRICS_ENABLED=0 installs none of the hooks.
+        'METRICS_ENABLED': os.environ.get('METRICS_ENABLED', '1') == '1',
+        # MongoDB commands slower than this are logged with their filter shape
+        'SLOW_QUERY_MS': int(os.environ.get('SLOW_QUERY_MS', 100)),
+    }
+
+
+def mongo_client_options(config):
+    """MongoClient keyword arguments from the MONGO_* settings."""
+    options = {
+        'maxPoolSize': config['MONGO_MAX_POOL_SIZE'],
+        'minPoolSize': config['MONGO_MIN_POOL_SIZE'],
+        'connectTimeoutMS': config['MONGO_CONNECT_TIMEOUT_MS'],
+        'serverSelectionTimeoutMS': config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'waitQueueTimeoutMS': config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        'maxIdleTimeMS': config['MONGO_MAX_IDLE_TIME_MS'],
+        'event_listeners': [mongo_metrics] if config['METRICS_ENABLED'] else [],
+    }
+    if config['MONGO_COMPRESSORS']:
+        options['compressors'] = config['MONGO_COMPRESSORS']
+    return options
 
-# Ensure upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# MongoDB setup
-# Use MONGO_URI env var if set, otherwise default to localhost
-MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URI)
-# Database name
-DB_NAME = os.environ.get('MONGO_DBNAME', 'final_project_db')
-db = client[DB_NAME]
+
+# Metrics are process-wide, like a Prometheus client's default registry
+metrics = Registry()
+mongo_metrics = MongoCommandMetrics(metrics)
+
+
+class Services(object):
+    """One app's MongoDB handles, caches, chat broker, hashing pool and rate limiter.
+
+    Built by create_app() from the app's config and kept in
+    ``app.extensions['studybuddy']``, so several apps in one process (tests
+    with different settings) never share state. Nothing connects to MongoDB
+    until the first query (see database.py).
+    """
+
+    def __init__(self, config):
+        self.connection = MongoConnection(config['MONGO_URI'], config['MONGO_DBNAME'],
+                                          client_class=config['MONGO_CLIENT_CLASS'], **mongo_client_options(config))
+        self.db = LazyDatabase(self.connection)
+        # Reads that tolerate replication lag; routed by READ_PREFERENCE
+        self.reads = LazyDatabase(self.connection)
+
+        self.hasher = PasswordHasher(
+            method=config['PASSWORD_HASH_METHOD'],
+            max_workers=config['HASH_WORKERS'],
+            max_pending=config['HASH_QUEUE_SIZE']
+        )
+        self.broker = create_broker(config['CHAT_BROKER'], self.db, message_event)
+        self.recent_messages = create_recent_messages(
+            config['RECENT_MESSAGES'], MESSAGE_FIELDS,
+            per_group=config['RECENT_MESSAGES_PER_GROUP'],
+            max_bytes=config['RECENT_MESSAGES_MAX_MB'] * 1024 * 1024,
+            ttl=config['RECENT_MESSAGES_TTL'],
+            redis_url=config['REDIS_URL'],
+            broker=config['CHAT_BROKER']
+        )
+        if config['RECENT_MESSAGES'] == 'memory' and self.recent_messages is not None:
+            # Posts handled by other workers, via a changestream or poll broker
+            self.broker.add_listener(self.recent_messages.add)
+        # Group documents by _id. Routes that change a group call invalidate_group().
+        self.group_cache = TTLCache(maxsize=config['GROUP_CACHE_SIZE'], ttl=config['GROUP_CACHE_TTL'])
+        # (group _id, username) -> bool. join/leave call membership_cache.invalidate().
+        self.membership_cache = TTLCache(maxsize=config['GROUP_CACHE_SIZE'] * 8, ttl=config['GROUP_CACHE_TTL'])
+        # Keys carry the document version, so entries only age out by LRU
+        self.fragment_cache = None
+        if config['FRAGMENT_CACHE_SIZE']:
+            self.fragment_cache = TTLCache(maxsize=config['FRAGMENT_CACHE_SIZE'], ttl=FRAGMENT_CACHE_TTL)
+        # Subject dropdown on the home page; invalidated whenever a group is
+        # added, edited or deleted
+        self.subject_facets = SubjectFacetCache()
+        self.rate_limiter = create_rate_limiter(config['RATE_LIMITS'], redis_url=config['REDIS_URL'])
+        # Changes whenever the templates do, so page validators from an older
+        # deploy never match; set once the templates are known
+        self.page_fingerprint = None
+
+
+def services(app=None):
+    """The Services of ``app``, by default the current app."""
+    return (app or current_app).extensions['studybuddy']
+
+
+# The current app's database handles. Modules take them as arguments, so
+# they stay usable anywhere an app context is pushed.
+db = LocalProxy(lambda: services().db)
+reads = LocalProxy(lambda: services().reads)
 
 # Collections used:
 # - db.groups
+# - db.memberships (see membership.py)
 # - db.messages
 # - db.users
 # - db.tasks
@@ -52,44 +265,453 @@ def serialize_group(doc):
         'course_number': doc.get('course_number'),
         'description': doc.get('description'),
         'creator': doc.get('creator'),
-        'members': doc.get('members') or [],
+        'member_count': doc.get('member_count', 0),
         'expiration_date': doc.get('expiration_date'),
         'video_link': doc.get('video_link')
     }
 
 
-def delete_group_files(group_id):
-    """Delete all uploaded files associated with a group."""
-    # Find all messages with file attachments for this group
-    messages_with_files = db.messages.find({
+def server_busy(template, busy):
+    """503 with Retry-After when the password hashing pool is saturated."""
+    flash('The server is busy right now. Please try again in a moment.', 'warning')
+    return render_template(template), 503, {'Retry-After': str(busy.retry_after)}
+
+
+# Negate 'completed' server-side, so concurrent toggles cannot lose an update
+TOGGLE_COMPLETED = [{'$set': {
+    'completed': {'$not': ['$completed']},
+    'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}
+}}]
+MAX_BULK_TASK_OPERATIONS = 500
+
+
+def new_task_doc(group_id, title, description, assigned_to, created_by):
+    """Return a new task document ready to insert."""
+    return {
         'group_id': group_id,
-        'file_url': {'$exists': True, '$ne': None}
-    })
+        'title': title,
+        'description': description,
+        'assigned_to': assigned_to if assigned_to else None,
+        'created_by': created_by,
+        'completed': False,
+        'created_at': datetime.now(),
+        'version': 1
+    }
 
-    deleted_count = 0
-    for msg in messages_with_files:
-        file_url = msg.get('file_url')
-        if file_url:
-            # Extract filename from URL (format: /static/uploads/filename)
-            # The file_url is like: /static/uploads/20251124_095227_Lab_11.pdf
-            filename = file_url.split('/')[-1]
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-            # Delete the file if it exists
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    deleted_count += 1
-            except Exception as e:
-                print(f"Error deleting file {file_path}: {e}")
+def optional_text(value):
+    """A JSON string field, stripped; '' for null or missing, None if it is not a string."""
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        return None
+    return value.strip()
+
 
-    # Delete all messages for this group
-    db.messages.delete_many({'group_id': group_id})
+def task_delete_filter(group_id, task_id, username):
+    """Match a task of the group only if ``username`` may delete it (creator or assignee)."""
+    return {
+        '_id': task_id,
+        'group_id': group_id,
+        '$or': [{'created_by': username}, {'assigned_to': username}]
+    }
 
-    # Delete all tasks for this group
-    db.tasks.delete_many({'group_id': group_id})
 
-    return deleted_count
+def get_group(oid):
+    """Load a group document, or None if it does not exist.
+
+    Looks in the current request first, then in group_cache, then in Mongo.
+    The returned document is shared; treat it as read-only.
+    """
+    request_groups = g.setdefault('groups', {})
+    if oid in request_groups:
+        return request_groups[oid]
+
+    group_doc = services().group_cache.get(oid)
+    if group_doc is None:
+        group_doc = db.groups.find_one({'_id': oid})
+        if group_doc is not None:
+            services().group_cache.set(oid, group_doc)
+
+    request_groups[oid] = group_doc
+    return group_doc
+
+
+def invalidate_group(oid):
+    """Drop a group from the caches after writing to it."""
+    services().group_cache.invalidate(oid)
+    g.get('groups', {}).pop(oid, None)
+
+
+def group_still_exists(oid):
+    """Check Mongo, not the caches, that a group exists before adding to it.
+
+    Deleting a group only clears the deleting worker's caches, so the others
+    can serve it from get_group() for up to GROUP_CACHE_TTL. Anything they
+    wrote for it in that time would be left behind by the teardown.
+    """
+    if db.groups.find_one({'_id': oid}, {'_id': 1}) is None:
+        invalidate_group(oid)
+        return False
+    return True
+
+
+# Session key holding the cluster and operation time of the user's last write
+CAUSAL_TIME_KEY = '_mongo_time'
+
+
+def request_session():
+    """This request's causally consistent MongoDB session, or None when reads are not routed.
+
+    Both ``db`` and ``reads`` run their operations in it, so a read on a
+    secondary waits until the secondary has applied the writes made earlier
+    in the request. The time of a request's writes is kept in the user's
+    cookie session and replayed into the next request's session, so the
+    posting user also sees their own writes on the page after the redirect.
+    """
+    if not has_request_context():
+        return None
+    mongo_session = g.get('mongo_session')
+    if mongo_session is None:
+        mongo_session = services().connection.start_session(causal_consistency=True)
+        saved = session.get(CAUSAL_TIME_KEY)
+        if saved:
+            cluster_time, operation_time = json_util.loads(saved)
+            mongo_session.advance_cluster_time(cluster_time)
+            mongo_session.advance_operation_time(operation_time)
+        g.mongo_session = mongo_session
+    return mongo_session
+
+
+def save_causal_time(response):
+    """Remember when this request's writes happened, for the user's next requests."""
+    mongo_session = g.get('mongo_session')
+    if mongo_session is not None and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        if mongo_session.cluster_time is not None and mongo_session.operation_time is not None:
+            # Canonical, so $clusterTime.signature.keyId comes back as the Int64
+            # the server insists on when the next request gossips it
+            session[CAUSAL_TIME_KEY] = json_util.dumps([mongo_session.cluster_time, mongo_session.operation_time],
+                                                       json_options=json_util.CANONICAL_JSON_OPTIONS)
+    return response
+
+
+def end_request_session(exc=None):
+    mongo_session = g.pop('mongo_session', None)
+    if mongo_session is not None:
+        mongo_session.end_session()
+
+
+def user_is_member(oid, username):
+    """Membership check: an index probe on db.memberships, cached briefly."""
+    key = (oid, username)
+    member = services().membership_cache.get(key)
+    if member is None:
+        member = is_member(db, oid, username)
+        services().membership_cache.set(key, member)
+    return member
+
+
+# Home page cards: a trimmed description instead of the full text
+GROUP_CARD_DESCRIPTION_LENGTH = 300
+
+GROUP_CARD_PROJECTION = {
+    'group_name': 1,
+    'subject': 1,
+    'course_number': 1,
+    'creator': 1,
+    'expiration_date': 1,
+    'video_link': 1,
+    'member_count': 1,
+    'message_count': 1,
+    'task_count': 1,
+    'tasks_completed': 1,
+    'last_activity_at': 1,
+    'version': 1,
+    'description': {'$substrCP': [{'$ifNull': ['$description', '']}, 0, GROUP_CARD_DESCRIPTION_LENGTH]}
+}
+
+
+def serialize_group_card(doc, is_member=False):
+    """Return a dict for a home page card from a GROUP_CARD_PROJECTION document."""
+    return {
+        'id': str(doc.get('_id')),
+        'group_name': doc.get('group_name'),
+        'subject': doc.get('subject'),
+        'course_number': doc.get('course_number'),
+        'description': doc.get('description'),
+        'creator': doc.get('creator'),
+        'member_count': doc.get('member_count', 0),
+        'message_count': doc.get('message_count', 0),
+        'task_count': doc.get('task_count', 0),
+        'tasks_completed': doc.get('tasks_completed', 0),
+        'last_activity_at': doc.get('last_activity_at'),
+        'is_member': is_member,
+        'version': doc.get('version', 0),
+        'expiration_date': doc.get('expiration_date'),
+        'video_link': doc.get('video_link')
+    }
+
+
+def render_fragment(template, doc_id, version, role, **context):
+    """Render a partial, reusing its HTML while the document's version is unchanged.
+
+    Every write to a group or task bumps its ``version``, so entries never
+    need invalidating. ``role`` names whatever about the viewer changes the
+    output (e.g. 'member' or 'visitor').
+    """
+    fragment_cache = services().fragment_cache
+    if fragment_cache is None:
+        return Markup(render_template(template, **context))
+    key = (template, doc_id, version, role)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(render_template(template, **context))
+        fragment_cache.set(key, html)
+    return html
+
+
+def template_fingerprint(app):
+    """Hash of the names, sizes and modification times of the app's templates."""
+    digest = hashlib.sha1()
+    for name in sorted(app.jinja_env.list_templates()):
+        path = os.path.join(app.root_path, app.template_folder, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:12]
+
+
+def page_etag(*state):
+    """Validator for a page rendered for the current user and URL from ``state``.
+
+    ``state`` must change whenever the page would render differently, e.g.
+    the versions of the documents shown.
+    """
+    key = repr((services().page_fingerprint, session.get('username'), request.full_path) + state)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def not_modified(etag):
+    """A 304 response if the client already has this version of the page, else None.
+
+    Never while a flashed message is waiting; the page has to show it.
+    """
+    if session.get('_flashes') or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_page_etag(Response(status=304), etag)
+
+
+def with_page_etag(body, etag):
+    response = make_response(body)
+    # Weak: the same page may be sent compressed or not (see compress())
+    response.set_etag(etag, weak=True)
+    # Pages are per user and must be revalidated on every view
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def newest_message_id(group_id):
+    """_id of a group's newest hot message; the group_timestamp index answers it."""
+    doc = reads.messages.find_one({'group_id': group_id}, {'_id': 1}, sort=[('timestamp', -1), ('_id', -1)])
+    return doc['_id'] if doc else None
+
+
+def task_list_state(group_id):
+    """(count, sum of versions, newest _id) of a group's tasks.
+
+    Every task write inserts, deletes or bumps a version, so this changes
+    whenever the task list does.
+    """
+    rows = list(reads.tasks.aggregate([
+        {'$match': {'group_id': group_id}},
+        {'$group': {'_id': None, 'count': {'$sum': 1},
+                    'versions': {'$sum': {'$ifNull': ['$version', 0]}}, 'newest': {'$max': '$_id'}}}
+    ]))
+    return (rows[0]['count'], rows[0]['versions'], rows[0]['newest']) if rows else (0, 0, None)
+
+
+# Only the fields the chat page displays
+MESSAGE_FIELDS = {
+    'sender_name': 1,
+    'message_text': 1,
+    'timestamp': 1,
+    'file_url': 1,
+    'file_name': 1,
+    'file_type': 1
+}
+
+
+def serialize_message(doc):
+    """Return a dict suitable for templates from a MongoDB message document."""
+    msg = {
+        'id': str(doc.get('_id')),
+        'sender_name': doc.get('sender_name'),
+        'message_text': doc.get('message_text'),
+        'timestamp': doc.get('timestamp')
+    }
+    # Add file information if present
+    if doc.get('file_url'):
+        msg['file_url'] = doc.get('file_url')
+        msg['file_name'] = doc.get('file_name')
+        msg['file_type'] = doc.get('file_type')
+    return msg
+
+
+def message_json(msg):
+    """JSON-safe version of a serialized message."""
+    data = dict(msg)
+    timestamp = msg.get('timestamp')
+    data['timestamp'] = timestamp.isoformat() if timestamp else None
+    data['timestamp_display'] = timestamp.strftime('%b %d, %Y at %I:%M %p') if timestamp else ''
+    return data
+
+
+def message_event(doc):
+    """(channel, event) published to a group's chat stream for a new message."""
+    return str(doc['group_id']), message_json(serialize_message(doc))
+
+
+def wants_fragment():
+    """True for fetch() posts from the chat page, which only need the new message back."""
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def chat_post_error(id, message):
+    """Report a rejected chat post: plain text for fetch(), flash and redirect otherwise."""
+    if wants_fragment():
+        return message, 400
+    flash(message, 'danger')
+    return redirect(url_for('.chat', id=id))
+
+
+# Posts with bodies larger than this are treated as uploads for the concurrency caps
+UPLOAD_BODY_THRESHOLD = 64 * 1024
+
+
+def rate_limit_chat_post(group_id, username):
+    """Spend the post's tokens, or raise RateLimited. Reads only the request headers."""
+    rate_limiter = services().rate_limiter
+    if rate_limiter is None:
+        return
+    config = current_app.config
+    # The body size is known from Content-Length; a chunked body may be up to MAX_CONTENT_LENGTH
+    size = request.content_length or config['MAX_CONTENT_LENGTH'] or 0
+    upload_bytes = config['UPLOAD_MB_PER_HOUR'] * 1024 * 1024
+    rate_limiter.take(
+        per_minute('user', f'post:user:{username}', config['CHAT_POSTS_PER_MINUTE']),
+        per_minute('group', f'post:group:{group_id}', config['CHAT_POSTS_PER_MINUTE_GROUP']),
+        per_minute('ip', f'post:ip:{request.remote_addr}', config['CHAT_POSTS_PER_MINUTE_IP']),
+        Bucket('upload_bytes', f'bytes:user:{username}', upload_bytes / 3600.0, upload_bytes, size)
+    )
+
+
+def upload_slots(username):
+    """Hold this user's and the server's upload slots while a large body is read and stored."""
+    size = request.content_length
+    rate_limiter = services().rate_limiter
+    if rate_limiter is None or (size is not None and size <= UPLOAD_BODY_THRESHOLD):
+        return nullcontext()
+    config = current_app.config
+    return rate_limiter.slot(('concurrent_uploads', f'uploads:user:{username}', config['UPLOADS_PER_USER']),
+                             ('concurrent_uploads', 'uploads:all', config['UPLOADS_CONCURRENT']))
+
+
+def too_many_requests(id, limited):
+    """429 with Retry-After for a rate-limited chat post.
+
+    Plain text for fetch(); a form post without JavaScript gets a small page
+    linking back to the chat, which costs no message or member queries.
+    """
+    if current_app.config['METRICS_ENABLED']:
+        rate_limited.inc(limit=limited.limit)
+    if limited.limit == 'concurrent_uploads':
+        message = 'Too many uploads in progress. Please try again in a moment.'
+    else:
+        message = f'You are posting too fast. Please try again in {limited.retry_after} seconds.'
+    headers = {'Retry-After': str(limited.retry_after)}
+    if wants_fragment():
+        return message, 429, headers
+    return render_template('rate_limited.html', message=message, group_id=id), 429, headers
+
+
+def encode_message_cursor(doc):
+    """Opaque keyset cursor pointing at a message: '<timestamp>_<id>'."""
+    return f"{doc['timestamp'].isoformat()}_{doc['_id']}"
+
+
+def decode_message_cursor(cursor):
+    """Inverse of encode_message_cursor. Raises ValueError on a bad cursor."""
+    timestamp_str, _, message_id = cursor.partition('_')
+    try:
+        return datetime.fromisoformat(timestamp_str), ObjectId(message_id)
+    except Exception:
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+
+def fetch_message_page(group_id, before=None, limit=None):
+    """Return (messages, next_cursor) for one page of a group's chat history.
+
+    Messages are the newest ``limit`` messages older than the ``before``
+    cursor, oldest first. ``next_cursor`` points at the oldest message on the
+    page, or is None when there is nothing older.
+    """
+    limit = limit or current_app.config['CHAT_PAGE_SIZE']
+    recent_messages = services().recent_messages
+    if before is None and recent_messages is not None:
+        services().broker.watch()
+        # Filled from the primary: posts arrive through add() only after the fill
+        page = recent_messages.page(group_id, limit, lambda n: newest_messages(group_id, n, source=db))
+        if page is not None:
+            docs, has_older = page
+            next_cursor = encode_message_cursor(docs[0]) if has_older and docs else None
+            return [serialize_message(d) for d in docs], next_cursor
+
+    # Fetch one extra message to find out whether an older page exists
+    docs = newest_messages(group_id, limit + 1, before, source=reads)
+    next_cursor = encode_message_cursor(docs[limit - 1]) if len(docs) > limit else None
+    docs = docs[:limit]
+    docs.reverse()
+
+    return [serialize_message(d) for d in docs], next_cursor
+
+
+def newest_messages(group_id, n, before=None, source=None):
+    """A group's newest ``n`` messages older than the ``before`` key, newest first.
+
+    Reads the hot collection and, if it runs out, carries on into the
+    archive (see archive.py). ``source`` is the database handle to read
+    from, ``reads`` by default.
+    """
+    source = source or reads
+    query = {'group_id': group_id}
+    if before:
+        timestamp, message_id = before
+        # Keyset on (timestamp, _id): walks the group_timestamp index backwards
+        query['$or'] = [
+            {'timestamp': {'$lt': timestamp}},
+            {'timestamp': timestamp, '_id': {'$lt': message_id}}
+        ]
+    docs = list(source.messages.find(query, MESSAGE_FIELDS).sort([('timestamp', -1), ('_id', -1)]).limit(n))
+    if len(docs) < n:
+        oldest = (docs[-1]['timestamp'], docs[-1]['_id']) if docs else before
+        docs.extend(archived_before(source, group_id, oldest, n - len(docs)))
+    return docs
+
+
+def delete_groups(group_ids):
+    """Delete groups with all their files, messages and tasks in one pass.
+
+    Returns the report from teardown_groups().
+    """
+    group_ids = list(group_ids)
+    report = teardown_groups(db, current_app.config['UPLOAD_FOLDER'], group_ids)
+    svc = services()
+    for group_id in group_ids:
+        svc.group_cache.invalidate(group_id)
+        if svc.recent_messages is not None:
+            svc.recent_messages.invalidate(group_id)
+    svc.subject_facets.invalidate()
+    return report
 
 
 # Login required decorator
@@ -98,13 +720,126 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
         return f(*args, **kwargs)
     return decorated_function
 
 
+request_duration = metrics.histogram(
+    'http_request_duration_seconds', 'Time to produce a response.', ('endpoint', 'method', 'status'))
+request_mongo_commands = metrics.histogram(
+    'http_request_mongo_commands', 'MongoDB commands run per request.', ('endpoint',), buckets=COUNT_BUCKETS)
+request_mongo_seconds = metrics.histogram(
+    'http_request_mongo_seconds', 'Time per request spent in MongoDB commands.', ('endpoint',))
+template_duration = metrics.histogram('template_render_seconds', 'render_template() time.', ('template',))
+upload_duration = metrics.histogram('upload_save_seconds', 'Time to hash and store an attachment.')
+password_hash_duration = metrics.histogram(
+    'password_hash_seconds', 'Password hashing time, including time queued for the pool.', ('operation',))
+rate_limited = metrics.counter('rate_limited_total', 'Requests rejected by a rate limit.', ('limit',))
+response_bytes = metrics.counter(
+    'http_response_compressed_bytes_total', 'Bytes of compressed response bodies, as sent.', ('encoding',))
+response_bytes_uncompressed = metrics.counter(
+    'http_response_uncompressed_bytes_total', 'The same response bodies before compression.', ('encoding',))
+
+# Cache name -> Services attribute
+CACHES = {'groups': 'group_cache', 'memberships': 'membership_cache',
+          'recent_messages': 'recent_messages', 'fragments': 'fragment_cache'}
+
+
+def cache_stat(stat):
+    """[((cache name,), value)] for the current app's caches that report ``stat``."""
+    rows = []
+    for name, attr in CACHES.items():
+        cache = getattr(services(), attr)
+        stats = cache.stats() if cache is not None else {}
+        if stat in stats:
+            rows.append(((name,), stats[stat]))
+    return rows
+
+
+metrics.gauge('cache_entries', 'Entries held by each in-process cache.', ('cache',), lambda: cache_stat('size'))
+metrics.gauge('cache_hits_total', 'Cache lookups that found an entry.', ('cache',),
+              lambda: cache_stat('hits'), kind='counter')
+metrics.gauge('cache_misses_total', 'Cache lookups that missed.', ('cache',),
+              lambda: cache_stat('misses'), kind='counter')
+metrics.gauge('cache_bytes', 'Approximate memory held by the recent message buffers.', ('cache',),
+              lambda: cache_stat('bytes'))
+metrics.gauge('password_hash_in_flight', 'Password hashes running or queued.', (),
+              lambda: [((), services().hasher.in_flight)])
+
+
+def timed(histogram, **labels):
+    """Time a block into ``histogram``; does nothing when metrics are off."""
+    return histogram.time(**labels) if current_app.config['METRICS_ENABLED'] else nullcontext()
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.render_seconds = 0.0
+    mongo_metrics.begin()
+
+
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    commands, mongo_seconds = mongo_metrics.tally()
+    request_duration.observe(seconds, endpoint=endpoint, method=request.method, status=response.status_code)
+    request_mongo_commands.observe(commands, endpoint=endpoint)
+    request_mongo_seconds.observe(mongo_seconds, endpoint=endpoint)
+    # The same breakdown for this one request, shown in the browser's network panel
+    response.headers['Server-Timing'] = (
+        f'db;desc="{commands} commands";dur={mongo_seconds * 1000:.1f}, '
+        f'render;dur={g.render_seconds * 1000:.1f}, total;dur={seconds * 1000:.1f}'
+    )
+    return response
+
+
+def start_template_timer(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+
+def record_template_time(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        seconds = time.perf_counter() - started
+        template_duration.observe(seconds, template=template.name)
+        g.render_seconds = g.get('render_seconds', 0.0) + seconds
+
+
+def install_metrics(app):
+    """Hook the request and template timers into ``app``."""
+    app.before_request(start_request_timer)
+    app.after_request(record_request_metrics)
+    before_render_template.connect(start_template_timer, app)
+    template_rendered.connect(record_template_time, app)
+
+
+def compress(response):
+    config = current_app.config
+    result = compress_response(response, request.accept_encodings, min_size=config['COMPRESS_MIN_SIZE'],
+                               gzip_level=config['COMPRESS_LEVEL'], brotli_quality=config['BROTLI_QUALITY'])
+    if result and config['METRICS_ENABLED']:
+        encoding, before, after = result
+        response_bytes_uncompressed.inc(before, encoding=encoding)
+        response_bytes.inc(after, encoding=encoding)
+    return response
+
+
+# Content-addressed attachments live under static/uploads too, but must go
+# through attachment() so that only group members can fetch them
+@bp.before_app_request
+def block_static_attachments():
+    if request.endpoint == 'static':
+        parts = (request.view_args or {}).get('filename', '').split('/')
+        if len(parts) == 3 and parts[0] == 'uploads' and ATTACHMENT_NAME.match(parts[2]):
+            abort(404)
+
+
 # Register route
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
@@ -129,25 +864,34 @@ def register():
             return render_template('register.html')
 
         # Create new user (store password hash)
-        password_hash = generate_password_hash(password)
-        db.users.insert_one({
-            'username': username,
-            'password_hash': password_hash,
-            'created_at': datetime.now()
-        })
+        try:
+            with timed(password_hash_duration, operation='hash'):
+                password_hash = services().hasher.hash(password)
+        except HasherBusy as busy:
+            return server_busy('register.html', busy)
+        try:
+            db.users.insert_one({
+                'username': username,
+                'password_hash': password_hash,
+                'created_at': datetime.now()
+            })
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration (unique index on username)
+            flash('Username already exists. Please choose a different one.', 'danger')
+            return render_template('register.html')
 
         flash(f'Account created successfully for {username}! Please log in.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     return render_template('register.html')
 
 
 # Login route
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     # If already logged in, redirect to index
     if 'user_id' in session:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
@@ -159,11 +903,26 @@ def login():
 
         user = db.users.find_one({'username': username})
 
-        if user and check_password_hash(user.get('password_hash', ''), password):
+        try:
+            with timed(password_hash_duration, operation='verify'):
+                valid = bool(user) and services().hasher.verify(user.get('password_hash', ''), password)
+        except HasherBusy as busy:
+            return server_busy('login.html', busy)
+
+        if valid:
+            # Upgrade hashes made with older parameters while we have the password
+            if services().hasher.needs_rehash(user.get('password_hash', '')):
+                try:
+                    db.users.update_one(
+                        {'_id': user['_id'], 'password_hash': user.get('password_hash')},
+                        {'$set': {'password_hash': services().hasher.hash(password)}}
+                    )
+                except HasherBusy:
+                    pass  # try again at the next login
             session['user_id'] = str(user.get('_id'))
             session['username'] = user.get('username')
             flash(f'Welcome back, {username}!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('.index'))
         else:
             flash('Invalid username or password!', 'danger')
             return render_template('login.html')
@@ -172,52 +931,146 @@ def login():
 
 
 # Logout route
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     username = session.get('username')
     session.clear()
     flash(f'Goodbye, {username}!', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 
 # Home route — list all groups
-@app.route('/')
+@bp.route('/')
 @login_required
 def index():
-    # Delete expired groups automatically
-    expired_cursor = list(db.groups.find({'expiration_date': {'$lte': datetime.now()}}))
-    expired_count = len(expired_cursor)
-    if expired_count:
-        # Delete files, messages, and tasks for each expired group
-        total_files_deleted = 0
-        for expired_group in expired_cursor:
-            files_deleted = delete_group_files(expired_group['_id'])
-            total_files_deleted += files_deleted
-
-        # Delete the expired groups
-        db.groups.delete_many({'expiration_date': {'$lte': datetime.now()}})
-
-        if total_files_deleted > 0:
-            flash(f'{expired_count} expired group(s) and {total_files_deleted} file(s) have been automatically deleted.', 'info')
-        else:
-            flash(f'{expired_count} expired group(s) have been automatically deleted.', 'info')
+    # Expired groups are reaped by the background sweeper (see expiry.py);
+    # just hide any that are waiting for the next sweep.
+    query = {'$or': [{'expiration_date': None}, {'expiration_date': {'$gt': datetime.now()}}]}
 
     subject_filter = request.args.get('subject', None)
-
     if subject_filter and subject_filter != 'All':
-        cursor = db.groups.find({'subject': subject_filter})
-    else:
-        cursor = db.groups.find()
-
-    groups = [serialize_group(g) for g in cursor]
+        query['subject'] = subject_filter
+
+    # Keyset pagination on _id: ?after=<id of the last group on the previous page>
+    after = request.args.get('after')
+    if after:
+        if not ObjectId.is_valid(after):
+            abort(400)
+        query['_id'] = {'$gt': ObjectId(after)}
+
+    page_size = current_app.config['GROUPS_PAGE_SIZE']
+    cursor = reads.groups.aggregate([
+        {'$match': query},
+        {'$sort': {'_id': 1}},
+        {'$limit': page_size + 1},
+        {'$project': GROUP_CARD_PROJECTION}
+    ])
+    docs = list(cursor)
+
+    # (subject, count) pairs for the filter dropdown
+    subjects = services().subject_facets.get(reads)
+
+    # Group versions change with every edit, join and leave. Which groups are
+    # visible also depends on the clock (expiry), so no stored marker can stand
+    # in for the page query: a 304 here saves the membership lookup and rendering.
+    etag = page_etag(tuple((d['_id'], d.get('version', 0)) for d in docs), tuple(subjects))
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # One query for which of this page's groups the viewer belongs to
+    my_group_ids = groups_among(db, session['username'], [d['_id'] for d in docs[:page_size]])
+    groups = [serialize_group_card(d, d['_id'] in my_group_ids) for d in docs]
+
+    next_after = None
+    if len(groups) > page_size:
+        groups = groups[:page_size]
+        next_after = groups[-1]['id']
+
+    for group in groups:
+        group['html'] = render_fragment('_group_card.html', group['id'], group['version'],
+                                        'member' if group['is_member'] else 'visitor', group=group)
+
+    return with_page_etag(render_template('index.html', groups=groups, subjects=subjects,
+                                          selected_subject=subject_filter, next_after=next_after,
+                                          is_first_page=not after), etag)
+
+# Groups the current user belongs to, most recently joined first
+@bp.route('/my-groups')
+@login_required
+def my_groups():
+    # Keyset pagination: ?before=<membership id of the last group on the previous page>
+    before = request.args.get('before')
+    if before:
+        if not ObjectId.is_valid(before):
+            abort(400)
+        before = ObjectId(before)
+
+    page_size = current_app.config['GROUPS_PAGE_SIZE']
+    memberships = user_memberships(reads, session['username'], before=before, limit=page_size + 1)
+
+    next_before = None
+    if len(memberships) > page_size:
+        memberships = memberships[:page_size]
+        next_before = str(memberships[-1]['_id'])
+
+    group_ids = [m['group_id'] for m in memberships]
+    docs = {d['_id']: d for d in reads.groups.aggregate([
+        {'$match': {'_id': {'$in': group_ids}}},
+        {'$project': GROUP_CARD_PROJECTION}
+    ])}
+    groups = [serialize_group_card(docs[gid], True) for gid in group_ids if gid in docs]
+
+    return render_template('my_groups.html', groups=groups, next_before=next_before, is_first_page=not before)
+
+# Full-text search over groups, and over messages and tasks of the user's groups
+@bp.route('/search')
+@login_required
+def search():
+    text = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'groups')
+    if scope not in text_search.SCOPES:
+        abort(400)
+    try:
+        # Clamped as search() does, so the pager links match the results shown
+        page = max(1, min(int(request.args.get('page', 1)), text_search.MAX_PAGE))
+    except ValueError:
+        abort(400)
+
+    # Optionally search inside one group the user belongs to
+    group = None
+    group_id = request.args.get('group')
+    if group_id:
+        if not ObjectId.is_valid(group_id):
+            abort(404)
+        group_doc = get_group(ObjectId(group_id))
+        if not group_doc:
+            abort(404)
+        if not user_is_member(group_doc['_id'], session['username']):
+            flash('Only group members can search this group!', 'danger')
+            return redirect(url_for('.index'))
+        group = serialize_group(group_doc)
+
+    results = None
+    if text:
+        if group:
+            group_ids = [ObjectId(group['id'])]
+        else:
+            group_ids = text_search.member_group_ids(reads, session['username'])
+        results = text_search.search(reads, scope, text, group_ids=group_ids, page=page)
 
-    # Get all unique subjects for the filter dropdown
-    subjects = sorted([s for s in db.groups.distinct('subject') if s])
+        # Label message and task hits with their group's name
+        if scope != 'groups':
+            hit_group_ids = list({r['group_id'] for r in results['results']})
+            names = {d['_id']: d.get('group_name') for d in reads.groups.find({'_id': {'$in': hit_group_ids}}, {'group_name': 1})}
+            for r in results['results']:
+                r['group_name'] = names.get(r['group_id'])
 
-    return render_template('index.html', groups=groups, subjects=subjects, selected_subject=subject_filter)
+    return render_template('search.html', q=text, scope=scope, scopes=text_search.SCOPES, group=group,
+                           page=page, results=results, archive_after_days=current_app.config['ARCHIVE_AFTER_DAYS'])
 
 # Add group route
-@app.route('/add', methods=['GET', 'POST'])
+@bp.route('/add', methods=['GET', 'POST'])
 @login_required
 def add_group():
     if request.method == 'POST':
@@ -251,16 +1104,23 @@ def add_group():
             'description': description,
             'video_link': video_link if video_link else None,
             'creator': creator,
-            'members': [creator]
+            'member_count': 0,
+            'message_count': 0,
+            'task_count': 0,
+            'tasks_completed': 0,
+            'last_activity_at': datetime.now(),
+            'version': 1
         }
         db.groups.insert_one(group_doc)
+        add_member(db, group_doc['_id'], creator)
+        services().subject_facets.invalidate()
         flash(f'Study group "{name}" has been created!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     return render_template('add_group.html')
 
 # Edit group route
-@app.route('/edit/<id>', methods=['GET', 'POST'])
+@bp.route('/edit/<id>', methods=['GET', 'POST'])
 @login_required
 def edit_group(id):
     # Load group by ObjectId
@@ -269,14 +1129,14 @@ def edit_group(id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': oid})
+    group_doc = get_group(oid)
     if not group_doc:
         abort(404)
 
     current_user = session.get('username')
     if current_user != group_doc.get('creator'):
         flash('Only the group creator can edit this group!', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     if request.method == 'POST':
         group_name = request.form['group_name']
@@ -310,13 +1170,15 @@ def edit_group(id):
             'video_link': video_link if video_link else None
         }
 
-        db.groups.update_one({'_id': oid}, {'$set': update_fields})
-        return redirect(url_for('index'))
+        db.groups.update_one({'_id': oid}, {'$set': update_fields, '$inc': {'version': 1}})
+        invalidate_group(oid)
+        services().subject_facets.invalidate()
+        return redirect(url_for('.index'))
 
     return render_template('edit_group.html', group=serialize_group(group_doc))
 
 # Delete group route
-@app.route('/delete/<id>', methods=['POST'])
+@bp.route('/delete/<id>', methods=['POST'])
 @login_required
 def delete_group(id):
     try:
@@ -324,32 +1186,31 @@ def delete_group(id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': oid})
+    group_doc = get_group(oid)
     if not group_doc:
         abort(404)
 
     current_user = session.get('username')
     if current_user != group_doc.get('creator'):
         flash('Only the group creator can delete this group!', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     group_name = group_doc.get('group_name')
 
-    # Delete all uploaded files, messages, and tasks for this group
-    deleted_files = delete_group_files(oid)
-
-    # Delete the group itself
-    db.groups.delete_one({'_id': oid})
+    # Delete the group with all its uploaded files, messages, and tasks
+    report = delete_groups([oid])
+    invalidate_group(oid)
+    deleted_files = report['files_deleted']
 
     if deleted_files > 0:
         flash(f'Study group "{group_name}" and {deleted_files} uploaded file(s) have been deleted!', 'success')
     else:
         flash(f'Study group "{group_name}" has been deleted!', 'success')
 
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 # Join group route
-@app.route('/join/<id>', methods=['POST'])
+@bp.route('/join/<id>', methods=['POST'])
 @login_required
 def join_group(id):
     username = session['username']
@@ -358,21 +1219,23 @@ def join_group(id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': oid})
+    group_doc = get_group(oid)
     if not group_doc:
         abort(404)
 
     # Try to add member if not present
-    result = db.groups.update_one({'_id': oid, 'members': {'$ne': username}}, {'$push': {'members': username}})
-    if result.modified_count == 0:
+    joined = add_member(db, oid, username)
+    invalidate_group(oid)
+    services().membership_cache.invalidate((oid, username))
+    if not joined:
         flash(f'You are already a member of "{group_doc.get("group_name")}"!', 'warning')
     else:
         flash(f'You successfully joined "{group_doc.get("group_name")}"!', 'success')
 
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 # Leave group route
-@app.route('/leave/<id>', methods=['POST'])
+@bp.route('/leave/<id>', methods=['POST'])
 @login_required
 def leave_group(id):
     username = session['username']
@@ -381,22 +1244,93 @@ def leave_group(id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': oid})
+    group_doc = get_group(oid)
     if not group_doc:
         abort(404)
 
     # Remove member if present
-    result = db.groups.update_one({'_id': oid, 'members': username}, {'$pull': {'members': username}})
-    if result.modified_count == 0:
+    left = remove_member(db, oid, username)
+    invalidate_group(oid)
+    services().membership_cache.invalidate((oid, username))
+    if not left:
         flash(f'You are not a member of "{group_doc.get("group_name")}"!', 'danger')
     else:
         flash(f'You have left "{group_doc.get("group_name")}".', 'info')
 
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
+
+
+def post_chat_message(oid, id, username):
+    """Store a posted message and its optional attachment, and fan it out."""
+    message_text = request.form.get('message', '').strip()
+    file = request.files.get('file')
+
+    # Check if at least message or file is provided
+    if not message_text and not file:
+        return chat_post_error(id, 'Please enter a message or attach a file!')
+
+    # Before the upload takes a blob reference the teardown would not release
+    if not group_still_exists(oid):
+        abort(404)
+
+    file_url = None
+    file_name = None
+    file_type = None
+    blob = None
+
+    # Handle file upload
+    if file and file.filename:
+        if allowed_file(file.filename):
+            # Stored once per distinct content, named by its SHA-256
+            filename = secure_filename(file.filename)
+            ext = '.' + file.filename.rsplit('.', 1)[1].lower()
+
+            try:
+                with timed(upload_duration):
+                    blob = store_upload(db, current_app.config['UPLOAD_FOLDER'], file, ext)
+                file_url = url_for('.attachment', id=id, name=blob['hash'] + blob['ext'])
+                file_name = filename
+                file_type = file.content_type
+            except Exception as e:
+                return chat_post_error(id, f'Error uploading file: {str(e)}')
+        else:
+            return chat_post_error(id, 'Invalid file type! Allowed types: images, PDF, Word, and text files.')
+
+    # Insert message with optional file attachment
+    message_doc = {
+        'group_id': oid,
+        'sender_name': username,
+        'message_text': message_text,
+        'timestamp': datetime.now()
+    }
+
+    if file_url:
+        message_doc['file_url'] = file_url
+        message_doc['file_name'] = file_name
+        message_doc['file_type'] = file_type
+        message_doc['file_hash'] = blob['hash']
+        message_doc['file_size'] = blob['size']
+
+    try:
+        db.messages.insert_one(message_doc)
+    except Exception:
+        if blob:
+            release_blobs(db, current_app.config['UPLOAD_FOLDER'], [blob['hash']])
+        raise
+    group_stats.record_message(db, oid, message_doc['timestamp'])
+    svc = services()
+    if svc.recent_messages is not None:
+        svc.recent_messages.add(message_doc)
+    channel, event = message_event(message_doc)
+    svc.broker.publish(channel, event)
+
+    if wants_fragment():
+        return render_template('_message.html', msg=serialize_message(message_doc)), 201
+    return redirect(url_for('.chat', id=id))
 
 
 # Chat route
-@app.route('/chat/<id>', methods=['GET', 'POST'])
+@bp.route('/chat/<id>', methods=['GET', 'POST'])
 @login_required
 def chat(id):
     try:
@@ -404,88 +1338,211 @@ def chat(id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': oid})
+    group_doc = get_group(oid)
     if not group_doc:
         abort(404)
 
     username = session['username']
-    members = group_doc.get('members', [])
-    if username not in members:
+    if not user_is_member(oid, username):
         flash('Only group members can access the chat!', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     if request.method == 'POST':
-        message_text = request.form.get('message', '').strip()
-        file = request.files.get('file')
-
-        # Check if at least message or file is provided
-        if not message_text and not file:
-            flash('Please enter a message or attach a file!', 'danger')
-            return redirect(url_for('chat', id=id))
-
-        file_url = None
-        file_name = None
-        file_type = None
-
-        # Handle file upload
-        if file and file.filename:
-            if allowed_file(file.filename):
-                # Create unique filename with timestamp
-                filename = secure_filename(file.filename)
-                timestamp_str = datetime.now().strftime('%Y%m%d_%H%M%S')
-                unique_filename = f"{timestamp_str}_{filename}"
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        # Checked from the headers alone, before the body is read. Slots
+        # first, so a post turned away for want of one keeps its tokens.
+        try:
+            with upload_slots(username):
+                rate_limit_chat_post(oid, username)
+                return post_chat_message(oid, id, username)
+        except RateLimited as limited:
+            return too_many_requests(id, limited)
 
-                try:
-                    file.save(file_path)
-                    file_url = url_for('static', filename=f'uploads/{unique_filename}')
-                    file_name = filename
-                    file_type = file.content_type
-                except Exception as e:
-                    flash(f'Error uploading file: {str(e)}', 'danger')
-                    return redirect(url_for('chat', id=id))
+    etag = page_etag(group_doc.get('version', 0), newest_message_id(oid))
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # Only the newest page; older pages are fetched from chat_messages()
+    messages, next_cursor = fetch_message_page(oid)
+
+    return with_page_etag(render_template('chat.html', group=serialize_group(group_doc), messages=messages,
+                                          next_cursor=next_cursor, current_user=username), etag)
+
+
+# Older chat history as JSON, one page at a time (used by "Load older messages")
+@bp.route('/chat/<id>/messages')
+@login_required
+def chat_messages(id):
+    try:
+        oid = ObjectId(id)
+    except Exception:
+        abort(404)
+
+    group_doc = get_group(oid)
+    if not group_doc:
+        abort(404)
+
+    if not user_is_member(oid, session['username']):
+        abort(403)
+
+    before = request.args.get('before')
+    try:
+        before = decode_message_cursor(before) if before else None
+        limit = int(request.args.get('limit', current_app.config['CHAT_PAGE_SIZE']))
+    except ValueError:
+        abort(400)
+    limit = max(1, min(limit, MAX_CHAT_PAGE_SIZE))
+
+    messages, next_cursor = fetch_message_page(oid, before=before, limit=limit)
+    return jsonify(messages=[message_json(m) for m in messages], next_cursor=next_cursor)
+
+
+# Live chat updates as Server-Sent Events
+@bp.route('/chat/<id>/stream')
+@login_required
+def chat_stream(id):
+    try:
+        oid = ObjectId(id)
+    except Exception:
+        abort(404)
+
+    group_doc = get_group(oid)
+    if not group_doc:
+        abort(404)
+
+    if not user_is_member(oid, session['username']):
+        abort(403)
+
+    # Subscribe before catching up so nothing posted in between is lost;
+    # the page ignores messages it already shows.
+    subscription = services().broker.subscribe(id)
+
+    # Replay what was posted since the last event the browser has: the
+    # Last-Event-ID header after a reconnect, otherwise the newest message
+    # the page rendered (an empty ``after`` means the page showed none)
+    missed = []
+    caught_up = True
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('after')
+    if last_event_id is not None:
+        query = {'group_id': oid}
+        if last_event_id:
+            last_doc = None
+            if ObjectId.is_valid(last_event_id):
+                last_doc = db.messages.find_one({'_id': ObjectId(last_event_id), 'group_id': oid}, {'timestamp': 1})
+            if last_doc:
+                query['$or'] = [
+                    {'timestamp': {'$gt': last_doc['timestamp']}},
+                    {'timestamp': last_doc['timestamp'], '_id': {'$gt': last_doc['_id']}}
+                ]
             else:
-                flash('Invalid file type! Allowed types: images, PDF, Word, and text files.', 'danger')
-                return redirect(url_for('chat', id=id))
-
-        # Insert message with optional file attachment
-        message_doc = {
-            'group_id': oid,
-            'sender_name': username,
-            'message_text': message_text,
-            'timestamp': datetime.now()
-        }
+                query = None
+        if query is not None:
+            cursor = db.messages.find(query, MESSAGE_FIELDS).sort(
+                [('timestamp', 1), ('_id', 1)]).limit(MAX_CHAT_PAGE_SIZE + 1)
+            missed = [message_json(serialize_message(m)) for m in cursor]
+            # Too far behind to replay; have the page reload instead of
+            # silently skipping the rest
+            caught_up = len(missed) <= MAX_CHAT_PAGE_SIZE
+
+    def generate():
+        try:
+            if not caught_up:
+                yield 'event: reload\ndata: {}\n\n'
+                return
+            for event in missed:
+                yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+            while not subscription.overflowed:
+                event = subscription.get(timeout=CHAT_STREAM_HEARTBEAT)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+            # Fell too far behind; the browser reconnects and replays from Mongo
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
-        if file_url:
-            message_doc['file_url'] = file_url
-            message_doc['file_name'] = file_name
-            message_doc['file_type'] = file_type
 
-        db.messages.insert_one(message_doc)
+# Serve a chat attachment to group members
+@bp.route('/chat/<id>/files/<name>')
+@login_required
+def attachment(id, name):
+    match = ATTACHMENT_NAME.match(name)
+    if not match or not ObjectId.is_valid(id):
+        abort(404)
+    digest, ext = match.groups()
+    oid = ObjectId(id)
+
+    group_doc = get_group(oid)
+    if not group_doc:
+        abort(404)
 
-        return redirect(url_for('chat', id=id))
+    if not user_is_member(oid, session['username']):
+        abort(403)
 
-    # Get all messages for this group
-    cursor = db.messages.find({'group_id': oid}).sort('timestamp', 1)
-    messages = []
-    for m in cursor:
-        msg = {
-            'sender_name': m.get('sender_name'),
-            'message_text': m.get('message_text'),
-            'timestamp': m.get('timestamp')
-        }
-        # Add file information if present
-        if m.get('file_url'):
-            msg['file_url'] = m.get('file_url')
-            msg['file_name'] = m.get('file_name')
-            msg['file_type'] = m.get('file_type')
-        messages.append(msg)
+    # The file must be attached to a message in this group
+    if not (db.messages.find_one({'group_id': oid, 'file_hash': digest}, {'_id': 1}) or
+            db.message_archive.find_one({'group_id': oid, 'file_hashes': digest}, {'_id': 1})):
+        abort(404)
 
-    return render_template('chat.html', group=serialize_group(group_doc), messages=messages, current_user=username)
+    accel_prefix = current_app.config['ATTACHMENT_ACCEL_REDIRECT']
+    if accel_prefix:
+        # nginx serves the file, including Range and conditional requests
+        response = Response(mimetype=None)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + blob_relpath(digest, ext)
+        response.headers.pop('Content-Type', None)
+    else:
+        path = blob_path(current_app.config['UPLOAD_FOLDER'], digest, ext)
+        if not os.path.exists(path):
+            abort(404)
+        # conditional=True answers If-None-Match/If-Modified-Since with 304
+        # and Range requests with 206
+        response = send_file(path, conditional=True, etag=digest, max_age=ATTACHMENT_MAX_AGE)
+
+    # Never changes under this name, but only members may see it
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = ATTACHMENT_MAX_AGE
+    response.cache_control.immutable = True
+    response.set_etag(digest)
+    return response
+
+
+# Download a group's messages, tasks, members and attachment list as NDJSON
+# (gzip with ?gzip=1), streamed from batched cursors (see transfer.py)
+@bp.route('/groups/<id>/export')
+@login_required
+def export_group_route(id):
+    try:
+        oid = ObjectId(id)
+    except Exception:
+        abort(404)
+
+    group_doc = get_group(oid)
+    if not group_doc:
+        abort(404)
+
+    if session['username'] != group_doc.get('creator'):
+        abort(403)
+
+    filename = f'group-{id}.ndjson'
+    lines = export_group(reads, oid)
+    if request.args.get('gzip') == '1':
+        body, filename, mimetype = gzip_chunks(lines), filename + '.gz', 'application/gzip'
+    else:
+        body, mimetype = lines, 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'Cache-Control': 'no-store',
+    })
 
 
 # Tasks route - view and manage tasks for a group
-@app.route('/tasks/<id>', methods=['GET', 'POST'])
+@bp.route('/tasks/<id>', methods=['GET', 'POST'])
 @login_required
 def tasks(id):
     try:
@@ -493,15 +1550,14 @@ def tasks(id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': oid})
+    group_doc = get_group(oid)
     if not group_doc:
         abort(404)
 
     username = session['username']
-    members = group_doc.get('members', [])
-    if username not in members:
+    if not user_is_member(oid, username):
         flash('Only group members can access the tasks!', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     if request.method == 'POST':
         task_title = request.form.get('task_title', '').strip()
@@ -510,23 +1566,25 @@ def tasks(id):
 
         if not task_title:
             flash('Please enter a task title!', 'danger')
-            return redirect(url_for('tasks', id=id))
-
-        db.tasks.insert_one({
-            'group_id': oid,
-            'title': task_title,
-            'description': task_description,
-            'assigned_to': assigned_to if assigned_to else None,
-            'created_by': username,
-            'completed': False,
-            'created_at': datetime.now()
-        })
+            return redirect(url_for('.tasks', id=id))
+
+        if not group_still_exists(oid):
+            abort(404)
+
+        db.tasks.insert_one(new_task_doc(oid, task_title, task_description, assigned_to, username))
+        group_stats.record_tasks(db, oid, added=1)
 
         flash('Task added successfully!', 'success')
-        return redirect(url_for('tasks', id=id))
+        return redirect(url_for('.tasks', id=id))
+
+    # The member list comes with the group's version
+    etag = page_etag(group_doc.get('version', 0), task_list_state(oid))
+    response = not_modified(etag)
+    if response:
+        return response
 
     # Get all tasks for this group
-    cursor = db.tasks.find({'group_id': oid}).sort('created_at', -1)
+    cursor = reads.tasks.find({'group_id': oid}).sort('created_at', -1)
     tasks_list = []
     for t in cursor:
         tasks_list.append({
@@ -536,14 +1594,23 @@ def tasks(id):
             'assigned_to': t.get('assigned_to'),
             'created_by': t.get('created_by'),
             'completed': t.get('completed'),
-            'created_at': t.get('created_at')
+            'created_at': t.get('created_at'),
+            'version': t.get('version', 0)
         })
 
-    return render_template('tasks.html', group=serialize_group(group_doc), tasks=tasks_list, current_user=username)
+    for task in tasks_list:
+        # Matches task_delete_filter(): only the creator or assignee may delete
+        can_delete = username in (task['created_by'], task['assigned_to'])
+        task['html'] = render_fragment('_task_row.html', task['id'], task['version'],
+                                       'owner' if can_delete else 'member',
+                                       task=task, group_id=id, can_delete=can_delete)
+
+    return with_page_etag(render_template('tasks.html', group=serialize_group(group_doc), tasks=tasks_list,
+                                          members=list_members(reads, oid), current_user=username), etag)
 
 
 # Toggle task completion
-@app.route('/tasks/<group_id>/toggle/<task_id>', methods=['POST'])
+@bp.route('/tasks/<group_id>/toggle/<task_id>', methods=['POST'])
 @login_required
 def toggle_task(group_id, task_id):
     try:
@@ -552,30 +1619,24 @@ def toggle_task(group_id, task_id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': group_oid})
+    group_doc = get_group(group_oid)
     if not group_doc:
         abort(404)
 
     username = session['username']
-    members = group_doc.get('members', [])
-    if username not in members:
+    if not user_is_member(group_oid, username):
         flash('Only group members can modify tasks!', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
-    task = db.tasks.find_one({'_id': task_oid})
-    if not task:
+    # Toggle the completed status in a single atomic update
+    if group_stats.toggle_task(db, group_oid, task_oid, TOGGLE_COMPLETED) is None:
         flash('Task not found!', 'danger')
-        return redirect(url_for('tasks', id=group_id))
-
-    # Toggle the completed status
-    new_status = not task.get('completed', False)
-    db.tasks.update_one({'_id': task_oid}, {'$set': {'completed': new_status}})
 
-    return redirect(url_for('tasks', id=group_id))
+    return redirect(url_for('.tasks', id=group_id))
 
 
 # Delete task
-@app.route('/tasks/<group_id>/delete/<task_id>', methods=['POST'])
+@bp.route('/tasks/<group_id>/delete/<task_id>', methods=['POST'])
 @login_required
 def delete_task(group_id, task_id):
     try:
@@ -584,32 +1645,360 @@ def delete_task(group_id, task_id):
     except Exception:
         abort(404)
 
-    group_doc = db.groups.find_one({'_id': group_oid})
+    group_doc = get_group(group_oid)
     if not group_doc:
         abort(404)
 
     username = session['username']
-    members = group_doc.get('members', [])
-    if username not in members:
+    if not user_is_member(group_oid, username):
         flash('Only group members can delete tasks!', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
-    task = db.tasks.find_one({'_id': task_oid})
-    if not task:
-        flash('Task not found!', 'danger')
-        return redirect(url_for('tasks', id=group_id))
-
-    # Only creator or assigned person can delete
-    if task.get('created_by') != username and task.get('assigned_to') != username:
-        flash('Only the task creator or assigned person can delete this task!', 'danger')
-        return redirect(url_for('tasks', id=group_id))
+    # Only creator or assigned person can delete; checked in the same operation
+    if not group_stats.delete_task(db, task_delete_filter(group_oid, task_oid, username)):
+        # Only failures pay for a second query to explain why
+        if db.tasks.find_one({'_id': task_oid, 'group_id': group_oid}, {'_id': 1}):
+            flash('Only the task creator or assigned person can delete this task!', 'danger')
+        else:
+            flash('Task not found!', 'danger')
+        return redirect(url_for('.tasks', id=group_id))
 
-    db.tasks.delete_one({'_id': task_oid})
     flash('Task deleted successfully!', 'success')
-    return redirect(url_for('tasks', id=group_id))
+    return redirect(url_for('.tasks', id=group_id))
+
+
+# Create, toggle, reassign or delete many tasks of a group in one request.
+# Body: {"operations": [{"op": "create", "title": "...", "description": "...", "assigned_to": "..."},
+#                       {"op": "toggle", "id": "<task id>"},
+#                       {"op": "reassign", "id": "<task id>", "assigned_to": "<member or null>"},
+#                       {"op": "delete", "id": "<task id>"}]}
+@bp.route('/tasks/<group_id>/bulk', methods=['POST'])
+@login_required
+def bulk_tasks(group_id):
+    try:
+        group_oid = ObjectId(group_id)
+    except Exception:
+        abort(404)
+
+    group_doc = get_group(group_oid)
+    if not group_doc:
+        abort(404)
+
+    username = session['username']
+    if not user_is_member(group_oid, username):
+        return jsonify(error='Only group members can modify tasks!'), 403
+
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify(error='Expected a non-empty "operations" list.'), 400
+    if len(operations) > MAX_BULK_TASK_OPERATIONS:
+        return jsonify(error=f'At most {MAX_BULK_TASK_OPERATIONS} operations per request.'), 400
+
+    # Check every assignee's membership with one query
+    assignees = {optional_text(op.get('assigned_to')) for op in operations if isinstance(op, dict)}
+    assignees -= {'', None}
+    members = members_among(db, group_oid, assignees) if assignees else set()
+
+    writes = []
+    created_ids = []
+    errors = []
+    toggles = 0
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            errors.append({'index': index, 'error': 'Operation must be an object.'})
+            continue
+        kind = op.get('op')
+
+        fields = {name: optional_text(op.get(name)) for name in ('title', 'description', 'assigned_to')}
+        invalid = [name for name, value in fields.items() if value is None]
+        if invalid:
+            errors.append({'index': index, 'error': f'"{invalid[0]}" must be a string or null.'})
+            continue
+
+        task_oid = None
+        if kind in ('toggle', 'reassign', 'delete'):
+            if not ObjectId.is_valid(op.get('id') or ''):
+                errors.append({'index': index, 'error': 'Invalid task id.'})
+                continue
+            task_oid = ObjectId(op['id'])
+
+        assigned_to = fields['assigned_to'] or None
+        if kind in ('create', 'reassign') and assigned_to and assigned_to not in members:
+            errors.append({'index': index, 'error': f'{assigned_to} is not a member of this group.'})
+            continue
+
+        if kind == 'create':
+            title = fields['title']
+            if not title:
+                errors.append({'index': index, 'error': 'Please enter a task title!'})
+                continue
+            task_doc = new_task_doc(group_oid, title, fields['description'], assigned_to, username)
+            task_doc['_id'] = ObjectId()
+            created_ids.append(str(task_doc['_id']))
+            writes.append(InsertOne(task_doc))
+        elif kind == 'toggle':
+            toggles += 1
+            writes.append(UpdateOne({'_id': task_oid, 'group_id': group_oid}, TOGGLE_COMPLETED))
+        elif kind == 'reassign':
+            writes.append(UpdateOne({'_id': task_oid, 'group_id': group_oid},
+                                  {'$set': {'assigned_to': assigned_to}, '$inc': {'version': 1}}))
+        elif kind == 'delete':
+            writes.append(DeleteOne(task_delete_filter(group_oid, task_oid, username)))
+        else:
+            errors.append({'index': index, 'error': f'Unknown operation: {kind}'})
+
+    # All or nothing: reject the batch if any operation is invalid
+    if errors:
+        return jsonify(errors=errors), 400
+
+    if created_ids and not group_still_exists(group_oid):
+        return jsonify(error='Group not found.'), 404
+
+    result = db.tasks.bulk_write(writes, ordered=False)
+    if result.inserted_count or result.deleted_count or (toggles and result.modified_count):
+        # Too mixed to count one by one
+        group_stats.recount_tasks(db, group_oid)
+    return jsonify(
+        inserted=result.inserted_count,
+        inserted_ids=created_ids,
+        matched=result.matched_count,
+        modified=result.modified_count,
+        deleted=result.deleted_count
+    )
+
+
+# Reap expired groups from the command line (e.g. from cron):
+#   flask --app app sweep-expired
+@bp.cli.command('sweep-expired')
+@click.option('--batch-size', default=100, show_default=True, help='Groups deleted per batch.')
+@click.option('--loop', is_flag=True, help='Keep sweeping every --interval seconds.')
+@click.option('--interval', default=60, show_default=True, help='Seconds between sweeps with --loop.')
+def sweep_expired_command(batch_size, loop, interval):
+    """Delete expired groups along with their files, messages and tasks."""
+    if loop:
+        sweeper = ExpirySweeper(db, delete_groups, interval=interval, batch_size=batch_size)
+        sweeper.run()
+        return
+    run = sweep_expired_groups(db, delete_groups, batch_size=batch_size)
+    click.echo(f"Deleted {run['groups_deleted']} expired group(s) and {run['files_deleted']} file(s) in {run['batches']} batch(es).")
+
+
+# Move old chat messages to compressed bundles, a few groups at a time:
+#   flask --app app archive-messages --max-groups 500
+@bp.cli.command('archive-messages')
+@click.option('--older-than-days', type=int, default=None, help='Defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', default=1000, show_default=True, help='Messages per bundle at most.')
+@click.option('--max-groups', type=int, default=None, help='Stop after this many groups; rerun to resume.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted run.')
+def archive_messages_command(older_than_days, batch_size, max_groups, restart):
+    """Archive chat messages older than the cut-off."""
+    days = older_than_days if older_than_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.now() - timedelta(days=days)
+    report = archive_messages(db, cutoff, batch_size=batch_size, max_groups=max_groups, restart=restart)
+    if report['resumed_after']:
+        click.echo(f"Resumed after group {report['resumed_after']}.")
+    click.echo(f"Archived {report['messages']} message(s) from {report['groups']} group(s) into {report['bundles']} bundle(s).")
+    if not report['complete']:
+        click.echo('Stopped at --max-groups; run again to continue.')
+
+
+# Copy a group between deployments (a .gz file name means gzip):
+#   flask --app app export-group <group id> -o group.ndjson.gz
+#   flask --app app import-group group.ndjson.gz
+@bp.cli.command('export-group')
+@click.argument('group_id')
+@click.option('--output', '-o', required=True, help='File to write; - for stdout.')
+@click.option('--batch-size', default=1000, show_default=True, help='Documents read per cursor batch.')
+def export_group_command(group_id, output, batch_size):
+    """Export a group as NDJSON."""
+    if not ObjectId.is_valid(group_id) or not db.groups.find_one({'_id': ObjectId(group_id)}, {'_id': 1}):
+        raise click.ClickException(f'No group {group_id}')
+    lines = export_group(db, ObjectId(group_id), batch_size=batch_size)
+    count = 0
+    with (nullcontext(click.get_text_stream('stdout')) if output == '-' else open_export(output, 'w')) as out:
+        for line in lines:
+            out.write(line)
+            count += 1
+    if output != '-':
+        click.echo(f"Wrote {count} record(s) to {output}.")
+
+
+@bp.cli.command('import-group')
+@click.argument('path')
+@click.option('--batch-size', default=1000, show_default=True, help='Documents per insert_many.')
+@click.option('--unordered', is_flag=True, help='Unordered inserts: faster, no insertion order.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted import.')
+def import_group_command(path, batch_size, unordered, restart):
+    """Import a group exported with export-group (resumes an interrupted run)."""
+    ensure_indexes(db)
+    try:
+        with open_export(path, 'r') as lines:
+            report = import_group(db, lines, batch_size=batch_size, ordered=not unordered, restart=restart)
+    except ExportFormatError as e:
+        raise click.ClickException(str(e))
+    if report['resumed_at_line']:
+        click.echo(f"Resumed at line {report['resumed_at_line']}.")
+    inserted, present = report['inserted'], report['already_present']
+    for record_type in sorted(set(inserted) | set(present)):
+        click.echo(f"{record_type:12} {inserted.get(record_type, 0)} inserted, {present.get(record_type, 0)} already present")
+
+
+# Rebuild the activity counters on group documents (safe to re-run):
+#   flask --app app reconcile-stats
+@bp.cli.command('reconcile-stats')
+@click.option('--group', 'group_ids', multiple=True, help='Only this group; repeatable.')
+@click.option('--batch-size', default=500, show_default=True, help='Groups per aggregation.')
+def reconcile_stats_command(group_ids, batch_size):
+    """Recompute member, message and task counters and last activity."""
+    if any(not ObjectId.is_valid(g) for g in group_ids):
+        raise click.ClickException('--group takes group ids')
+    ids = [ObjectId(g) for g in group_ids] or None
+    processed = group_stats.reconcile(db, ids, batch_size=batch_size)
+    click.echo(f"Reconciled {processed} group(s).")
+
+
+# Cache statistics for this worker process
+@bp.route('/stats/cache')
+@login_required
+def cache_stats():
+    svc = services()
+    return jsonify(groups=svc.group_cache.stats(), memberships=svc.membership_cache.stats(),
+                   recent_messages=svc.recent_messages.stats() if svc.recent_messages is not None else None,
+                   fragments=svc.fragment_cache.stats() if svc.fragment_cache is not None else None)
+
+
+# Prometheus scrape target for this worker process (see metrics.py)
+@bp.route('/metrics')
+def metrics_endpoint():
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Remove attachment files nothing references any more:
+#   flask --app app gc-uploads
+@bp.cli.command('gc-uploads')
+def gc_uploads_command():
+    """Delete unreferenced attachment blobs."""
+    deleted = collect_garbage(db, current_app.config['UPLOAD_FOLDER'])
+    click.echo(f"Deleted {deleted} unreferenced file(s).")
+
+
+# Compare password hash settings on this machine:
+#   flask --app app bench-hash -m scrypt:16384:8:1 -m pbkdf2:sha256:600000
+@bp.cli.command('bench-hash')
+@click.option('--method', '-m', 'methods', multiple=True, help='werkzeug hash method; repeatable.')
+@click.option('--rounds', default=5, show_default=True)
+def bench_hash_command(methods, rounds):
+    """Time password hash methods (defaults to PASSWORD_HASH_METHOD)."""
+    methods = methods or [current_app.config['PASSWORD_HASH_METHOD']]
+    workers = current_app.config['HASH_WORKERS']
+    for method, seconds in benchmark_hashing(methods, rounds):
+        click.echo(f"{method:28} {seconds * 1000:8.1f} ms/hash  ~{workers / seconds:7.1f} logins/s with {workers} worker(s)")
+
+
+# Move members arrays out of group documents (safe to re-run):
+#   flask --app app migrate-members
+@bp.cli.command('migrate-members')
+@click.option('--batch-size', default=500, show_default=True, help='Groups migrated per batch.')
+def migrate_members_command(batch_size):
+    """Copy embedded group members into the memberships collection."""
+    ensure_indexes(db)
+    groups, memberships = migrate_embedded_members(db, batch_size=batch_size)
+    click.echo(f"Migrated {groups} group(s); created {memberships} membership(s).")
+
+
+# Create indexes (safe to re-run):
+#   flask --app app init-db
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create any missing MongoDB indexes."""
+    for collection, names in ensure_indexes(db).items():
+        click.echo(f"{collection}: {', '.join(names)}")
+
+
+# Show which hot queries are served by an index:
+#   flask --app app index-report
+@bp.cli.command('index-report')
+def index_report_command():
+    """Explain the app's hot queries and report index coverage."""
+    for row in coverage_report(db):
+        status = 'indexed' if row['covered'] else 'COLLECTION SCAN'
+        click.echo(f"{status:16} {row['description']}  [{' > '.join(row['stages'])}]")
+
+
+# Liveness and readiness for load balancers and gunicorn: 200 when MongoDB answers a ping
+@bp.route('/healthz')
+def healthz():
+    start = time.perf_counter()
+    try:
+        services().connection.ping()
+    except PyMongoError as e:
+        return jsonify(status='unavailable', error=type(e).__name__), 503
+    return jsonify(status='ok', mongo_ms=round((time.perf_counter() - start) * 1000, 1))
+
+
+def warm_up(app):
+    """Open ``app``'s MongoDB pool in this process before the first request needs it.
+
+    Called from gunicorn's post_worker_init hook (see gunicorn.conf.py). A
+    failure is not fatal; requests retry the connection themselves.
+    """
+    try:
+        services(app).connection.ping()
+    except PyMongoError as e:
+        logging.getLogger(__name__).warning('MongoDB warm-up failed: %s', e)
+
+
+def create_app(config=None):
+    """Build the application. ``config`` overrides the environment settings.
+
+    Nothing connects to MongoDB here, so the app can be created in a parent
+    process (gunicorn --preload, tests, the flask CLI) and forked safely.
+    """
+    app = Flask(__name__, static_url_path='', static_folder='static')
+    app.config.update(default_config())
+    if config:
+        app.config.update(config)
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # The one process-wide setting: the command listener is shared by every client
+    mongo_metrics.slow_ms = app.config['SLOW_QUERY_MS']
+
+    svc = app.extensions['studybuddy'] = Services(app.config)
+
+    # Lag-tolerant reads; with anything but the primary, every request runs in a
+    # causally consistent session so users still read their own writes
+    preference = read_preference(app.config['READ_PREFERENCE'], app.config['READ_MAX_STALENESS_S'])
+    if app.config['READ_PREFERENCE'] != 'primary':
+        svc.db.configure(session=request_session)
+        svc.reads.configure(session=request_session, read_preference=preference)
+        app.after_request(save_causal_time)
+        app.teardown_request(end_request_session)
+    else:
+        svc.reads.configure(read_preference=preference)
+
+    app.register_blueprint(bp)
+    svc.page_fingerprint = template_fingerprint(app)
+    if app.config['METRICS_ENABLED']:
+        install_metrics(app)
+    if app.config['COMPRESS_RESPONSES']:
+        # Registered last so it runs first, and the request timer includes it
+        app.after_request(compress)
+    return app
 
 
 # Run app
 if __name__ == '__main__':
-    # MongoDB does not require creating tables; just run the app.
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app()
+    # MongoDB does not require creating tables, but make sure the indexes exist.
+    ensure_indexes(services(app).db)
+    # The development server sweeps expired groups in a background thread.
+    # Only start it in the reloader's child process so a single sweeper runs.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        def delete_groups_in_app(group_ids):
+            with app.app_context():
+                return delete_groups(group_ids)
+        ExpirySweeper(services(app).db, delete_groups_in_app, interval=int(os.environ.get('EXPIRY_SWEEP_INTERVAL', 60))).start()
+    app.run(debug=True)
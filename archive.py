@@ -0,0 +1,154 @@
+"""Cold storage for old chat messages.
+
+Messages older than a cut-off move out of ``db.messages`` into compressed
+bundles in ``db.message_archive``, one or more per group and calendar month::
+
+    {'_id': ObjectId (the first message's _id), 'group_id': ObjectId,
+     'period': '2025-11', 'count': 1000,
+     'first_ts': datetime, 'first_id': ObjectId, 'last_ts': datetime, 'last_id': ObjectId,
+     'file_hashes': [...], 'file_urls': [...],   # attachments, for teardown
+     'data': zlib-compressed BSON {'messages': [...]}, 'archived_at': datetime}
+
+The hot collection and its indexes then only hold recent chat. Bundles are
+found by the (group_id, last_ts, last_id) index, so an older page of chat
+history costs one index lookup and a decompression.
+
+``archive_messages`` is incremental and resumable: bundles are written
+before their messages are deleted, keyed by the first message's _id so a
+rerun after a crash rewrites the same bundle, and progress through the
+groups is checkpointed in ``db.archive_runs``.
+"""
+from datetime import datetime
+import zlib
+
+import bson
+
+DEFAULT_BATCH_SIZE = 1000  # messages per bundle at most
+CHECKPOINT_ID = 'messages'
+
+
+def _key(doc):
+    return doc['timestamp'], doc['_id']
+
+
+def _older_than(key, ts_field='timestamp', id_field='_id'):
+    """Filter for documents whose (timestamp, _id) sorts before ``key``."""
+    timestamp, _id = key
+    return {'$or': [
+        {ts_field: {'$lt': timestamp}},
+        {ts_field: timestamp, id_field: {'$lt': _id}}
+    ]}
+
+
+def _bundle(group_id, period, docs):
+    file_hashes = [d['file_hash'] for d in docs if d.get('file_hash')]
+    file_urls = [d['file_url'] for d in docs if d.get('file_url') and not d.get('file_hash')]
+    return {
+        '_id': docs[0]['_id'],
+        'group_id': group_id,
+        'period': period,
+        'count': len(docs),
+        'first_ts': docs[0]['timestamp'],
+        'first_id': docs[0]['_id'],
+        'last_ts': docs[-1]['timestamp'],
+        'last_id': docs[-1]['_id'],
+        'file_hashes': file_hashes,
+        'file_urls': file_urls,
+        'data': zlib.compress(bson.encode({'messages': docs})),
+        'archived_at': datetime.now()
+    }
+
+
+def unpack(bundle):
+    """The messages in a bundle, oldest first."""
+    return bson.decode(zlib.decompress(bundle['data']))['messages']
+
+
+def archive_group(db, group_id, older_than, batch_size=DEFAULT_BATCH_SIZE):
+    """Archive one group's messages older than ``older_than``. Returns (messages, bundles)."""
+    moved = bundles = 0
+    while True:
+        docs = list(db.messages.find({'group_id': group_id, 'timestamp': {'$lt': older_than}})
+                    .sort([('timestamp', 1), ('_id', 1)]).limit(batch_size))
+        if not docs:
+            break
+
+        # One bundle per calendar month in this batch
+        by_period = {}
+        for doc in docs:
+            by_period.setdefault(doc['timestamp'].strftime('%Y-%m'), []).append(doc)
+        for period, period_docs in by_period.items():
+            bundle = _bundle(group_id, period, period_docs)
+            db.message_archive.replace_one({'_id': bundle['_id']}, bundle, upsert=True)
+            bundles += 1
+
+        moved += db.messages.delete_many({'_id': {'$in': [d['_id'] for d in docs]}}).deleted_count
+        if len(docs) < batch_size:
+            break
+    return moved, bundles
+
+
+def archive_messages(db, older_than, batch_size=DEFAULT_BATCH_SIZE, max_groups=None, restart=False):
+    """Archive every group's messages older than ``older_than``, group by group.
+
+    Picks up after the last group finished by an interrupted run unless
+    ``restart``. ``max_groups`` bounds the work done in one call. Returns a
+    report; ``complete`` is True once every group has been visited.
+    """
+    checkpoint = None if restart else db.archive_runs.find_one({'_id': CHECKPOINT_ID})
+    after = checkpoint.get('after_group') if checkpoint else None
+    report = {'groups': 0, 'messages': 0, 'bundles': 0, 'complete': False, 'resumed_after': after}
+
+    query = {'_id': {'$gt': after}} if after else {}
+    for group in db.groups.find(query, {'_id': 1}).sort('_id', 1):
+        if max_groups is not None and report['groups'] >= max_groups:
+            return report
+        moved, bundles = archive_group(db, group['_id'], older_than, batch_size)
+        report['groups'] += 1
+        report['messages'] += moved
+        report['bundles'] += bundles
+        db.archive_runs.update_one(
+            {'_id': CHECKPOINT_ID},
+            {'$set': {'after_group': group['_id'], 'older_than': older_than, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+
+    # Every group visited; the next run starts from the beginning
+    db.archive_runs.update_one(
+        {'_id': CHECKPOINT_ID},
+        {'$set': {'after_group': None, 'completed_at': datetime.now()}},
+        upsert=True
+    )
+    report['complete'] = True
+    return report
+
+
+def archived_before(db, group_id, before, limit):
+    """Up to ``limit`` archived messages of a group, newest first.
+
+    ``before`` is a (timestamp, _id) key; only older messages are returned.
+    None means the newest archived messages.
+    """
+    query = {'group_id': group_id}
+    if before:
+        query.update(_older_than(before, 'first_ts', 'first_id'))
+    cursor = db.message_archive.find(query).sort([('last_ts', -1), ('last_id', -1)])
+
+    collected = []
+    for bundle in cursor:
+        # Bundles of a group rarely overlap, but stop only once no later
+        # bundle can hold anything newer than what is already collected
+        if len(collected) >= limit and (bundle['last_ts'], bundle['last_id']) < _key(collected[limit - 1]):
+            break
+        docs = unpack(bundle)
+        if before:
+            docs = [d for d in docs if _key(d) < before]
+        collected.extend(docs)
+        collected.sort(key=_key, reverse=True)
+    return collected[:limit]
+
+
+def iter_archived(db, group_id):
+    """Every archived message of a group, oldest first, one bundle in memory at a time."""
+    for bundle in db.message_archive.find({'group_id': group_id}).sort([('first_ts', 1), ('first_id', 1)]):
+        yield from unpack(bundle)
@@ -0,0 +1,483 @@
+"""Load test for the StudyBuddy routes.
+
+Seeds synthetic users, groups, memberships, messages, attachments and tasks,
+then drives the routes through Flask's test client and reports p50/p95/p99
+latency and throughput for each scenario. Results are written as JSON
+(tagged with the git commit) so runs can be compared across commits.
+
+Backends:
+  --mongo-uri URI     an existing mongod; uses (and drops) the database
+                      given by --db-name
+  --spawn-mongod      starts a throwaway mongod from $PATH on a temp dir;
+                      add --replica-set to make it a one-member replica set
+  --backend mongomock in-memory stand-in (pip install mongomock). It lacks
+                      some operators the app uses ($substrCP, pipeline
+                      updates, $text); affected scenarios report errors.
+
+Examples:
+  python benchmark.py --spawn-mongod --groups 500 --messages-per-group 200
+  python benchmark.py --mongo-uri mongodb://localhost:27017/ -o before.json
+  python benchmark.py --mongo-uri mongodb://localhost:27017/ -o after.json --compare before.json
+  python benchmark.py --spawn-mongod --replica-set --read-preference secondaryPreferred -s chat_post
+  python benchmark.py --backend mongomock -s chat_get -s chat_revalidate -o plain.json
+  python benchmark.py --backend mongomock -s chat_get -s chat_revalidate --accept-encoding 'gzip, br' \
+      --compare plain.json
+"""
+from datetime import datetime, timedelta
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import app as studybuddy
+
+SCENARIOS = ['login', 'index', 'chat_get', 'chat_post', 'tasks', 'join_group', 'expiry_sweep',
+             'index_revalidate', 'chat_revalidate', 'tasks_revalidate']
+PASSWORD = 'benchmark-password'
+# Cheap hashing so login numbers measure the app rather than scrypt
+HASH_METHOD = 'pbkdf2:sha256:1000'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    backend = parser.add_argument_group('backend')
+    backend.add_argument('--backend', choices=['mongod', 'mongomock'], default='mongod')
+    backend.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'))
+    backend.add_argument('--db-name', default='studybuddy_benchmark')
+    backend.add_argument('--spawn-mongod', action='store_true', help='Start a throwaway mongod for the run.')
+    backend.add_argument('--replica-set', action='store_true',
+                         help='With --spawn-mongod: run it as a single-member replica set.')
+    backend.add_argument('--read-preference', default='primary',
+                         help="READ_PREFERENCE for the app, e.g. 'secondaryPreferred' (needs a replica set).")
+
+    data = parser.add_argument_group('data')
+    data.add_argument('--users', type=int, default=200)
+    data.add_argument('--groups', type=int, default=100)
+    data.add_argument('--members-per-group', type=int, default=10)
+    data.add_argument('--messages-per-group', type=int, default=200)
+    data.add_argument('--tasks-per-group', type=int, default=20)
+    data.add_argument('--attachments', type=int, default=50, help='Distinct attachment files.')
+    data.add_argument('--attachments-per-group', type=int, default=5)
+    data.add_argument('--attachment-size', type=int, default=64 * 1024, help='Bytes per attachment.')
+    data.add_argument('--seed', type=int, default=1)
+
+    run = parser.add_argument_group('run')
+    run.add_argument('--scenario', '-s', action='append', choices=SCENARIOS,
+                     help='Scenario to run; repeatable (default: all).')
+    run.add_argument('--requests', '-n', type=int, default=200, help='Requests per scenario.')
+    run.add_argument('--concurrency', '-c', type=int, default=4, help='Client threads per scenario.')
+    run.add_argument('--accept-encoding', default=None,
+                     help='Accept-Encoding sent with every request, e.g. "gzip, br" (default: none).')
+    run.add_argument('--sweep-rounds', type=int, default=5)
+    run.add_argument('--sweep-batch', type=int, default=20, help='Groups expired per sweep round.')
+    run.add_argument('--output', '-o', help='Write results as JSON to this file.')
+    run.add_argument('--compare', help='Earlier results JSON to compare against.')
+    return parser.parse_args(argv)
+
+
+def spawn_mongod(replica_set=False):
+    """Start mongod on a free port with a temporary dbpath. Returns (uri, process, dbpath).
+
+    With ``replica_set``, the mongod is initiated as the only member of
+    replica set ``rs0``, which is enough for sessions and read preferences.
+    """
+    if not shutil.which('mongod'):
+        sys.exit('mongod not found on PATH')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    dbpath = tempfile.mkdtemp(prefix='studybuddy-bench-')
+    command = ['mongod', '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet']
+    if replica_set:
+        command += ['--replSet', 'rs0']
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            break
+        except OSError:
+            time.sleep(0.2)
+    else:
+        process.kill()
+        sys.exit('mongod did not start')
+
+    if not replica_set:
+        return f'mongodb://127.0.0.1:{port}/', process, dbpath
+
+    from pymongo import MongoClient
+    client = MongoClient('127.0.0.1', port, directConnection=True)
+    client.admin.command('replSetInitiate', {'_id': 'rs0', 'members': [{'_id': 0, 'host': f'127.0.0.1:{port}'}]})
+    while time.time() < deadline:
+        if client.admin.command('hello').get('isWritablePrimary'):
+            client.close()
+            return f'mongodb://127.0.0.1:{port}/?replicaSet=rs0', process, dbpath
+        time.sleep(0.2)
+    client.close()
+    process.kill()
+    sys.exit('mongod did not become primary')
+
+
+def load_app(args, upload_folder):
+    """Build the app pointed at the benchmark database."""
+    config = {}
+    if args.backend == 'mongomock':
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit('--backend mongomock needs: pip install mongomock')
+        config['MONGO_CLIENT_CLASS'] = mongomock.MongoClient
+
+    return studybuddy.create_app(dict(config, **{
+        'TESTING': True,
+        'MONGO_URI': args.mongo_uri,
+        'MONGO_DBNAME': args.db_name,
+        'UPLOAD_FOLDER': upload_folder,
+        'PASSWORD_HASH_METHOD': HASH_METHOD,
+        # Every simulated user posts from the same address
+        'RATE_LIMITS': 'off',
+        'READ_PREFERENCE': args.read_preference
+    }))
+
+
+def chunked_insert(collection, docs, size=1000):
+    for i in range(0, len(docs), size):
+        collection.insert_many(docs[i:i + size], ordered=False)
+
+
+def seed(flask_app, args, rng):
+    """Fill the database. Returns the (username, group _id) membership pairs."""
+    from bson.objectid import ObjectId
+    from werkzeug.security import generate_password_hash
+    from indexes import ensure_indexes
+    from storage import blob_path
+
+    db = studybuddy.services(flask_app).db
+    for name in ('users', 'groups', 'memberships', 'messages', 'tasks', 'blobs', 'sweep_runs'):
+        db[name].drop()
+    ensure_indexes(db)
+
+    # All users share one password, so one hash serves every account
+    password_hash = generate_password_hash(PASSWORD, method=HASH_METHOD)
+    usernames = [f'user{i}' for i in range(args.users)]
+    chunked_insert(db.users, [
+        {'username': u, 'password_hash': password_hash, 'created_at': datetime.now()} for u in usernames
+    ])
+
+    # Attachment files, shared across groups like real course material
+    blobs = []
+    root = flask_app.config['UPLOAD_FOLDER']
+    for i in range(args.attachments):
+        content = (f'attachment {i} '.encode() * (args.attachment_size // 12 + 1))[:args.attachment_size]
+        digest = hashlib.sha256(content).hexdigest()
+        path = blob_path(root, digest, '.pdf')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        blobs.append(digest)
+    refcounts = dict.fromkeys(blobs, 0)
+
+    subjects = ['Math', 'Physics', 'Biology', 'Chemistry', 'History', 'Computer Science']
+    base = datetime.now() - timedelta(days=30)
+    pairs = []
+    groups, memberships, messages, tasks = [], [], [], []
+    for i in range(args.groups):
+        group_id = ObjectId()
+        members = rng.sample(usernames, min(args.members_per_group, len(usernames)))
+        groups.append({
+            '_id': group_id,
+            'group_name': f'Study group {i}',
+            'subject': subjects[i % len(subjects)],
+            'course_number': f'{1000 + i}',
+            'description': 'Weekly study sessions. ' * 10,
+            'expiration_date': None,
+            'video_link': None,
+            'creator': members[0],
+            'member_count': len(members)
+        })
+        for username in members:
+            memberships.append({'group_id': group_id, 'username': username, 'joined_at': base})
+            pairs.append((username, group_id))
+
+        attachment_slots = set(rng.sample(range(args.messages_per_group),
+                                          min(args.attachments_per_group, args.messages_per_group)))
+        for j in range(args.messages_per_group):
+            message = {
+                'group_id': group_id,
+                'sender_name': rng.choice(members),
+                'message_text': f'Message {j} about chapter {j % 12}',
+                'timestamp': base + timedelta(seconds=j * 60)
+            }
+            if j in attachment_slots and blobs:
+                digest = rng.choice(blobs)
+                refcounts[digest] += 1
+                message.update({
+                    'file_url': f'/chat/{group_id}/files/{digest}.pdf',
+                    'file_name': f'notes-{j}.pdf',
+                    'file_type': 'application/pdf',
+                    'file_hash': digest,
+                    'file_size': args.attachment_size
+                })
+            messages.append(message)
+
+        for j in range(args.tasks_per_group):
+            tasks.append(studybuddy.new_task_doc(group_id, f'Task {j}', 'Read the chapter', rng.choice(members), members[0]))
+
+    chunked_insert(db.groups, groups)
+    chunked_insert(db.memberships, memberships)
+    chunked_insert(db.messages, messages)
+    chunked_insert(db.tasks, tasks)
+    if blobs:
+        db.blobs.insert_many([
+            {'_id': d, 'ext': '.pdf', 'size': args.attachment_size, 'content_type': 'application/pdf',
+             'refcount': n, 'created_at': datetime.now()}
+            for d, n in refcounts.items()
+        ])
+    return pairs
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, wall_time, first_error=None, sizes=None, not_modified=0):
+    latencies = sorted(latencies)
+    ms = [x * 1000 for x in latencies]
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'first_error': first_error,
+        'not_modified': not_modified,
+        'mean_bytes': statistics.mean(sizes) if sizes else None,
+        'p50_ms': percentile(ms, 50),
+        'p95_ms': percentile(ms, 95),
+        'p99_ms': percentile(ms, 99),
+        'mean_ms': statistics.mean(ms) if ms else None,
+        'throughput_rps': len(latencies) / wall_time if wall_time else None
+    }
+
+
+def run_requests(flask_app, args, rng, pairs, make_request):
+    """Run ``make_request(client, username, group_id)`` --requests times on --concurrency threads."""
+    latencies = []
+    sizes = []
+    state = {'errors': 0, 'first_error': None, 'not_modified': 0}
+    lock = threading.Lock()
+    per_thread = [args.requests // args.concurrency + (1 if i < args.requests % args.concurrency else 0)
+                  for i in range(args.concurrency)]
+
+    def worker(count, thread_rng):
+        client = flask_app.test_client()
+        if args.accept_encoding:
+            client.environ_base['HTTP_ACCEPT_ENCODING'] = args.accept_encoding
+        for _ in range(count):
+            username, group_id = thread_rng.choice(pairs)
+            with client.session_transaction() as sess:
+                sess['user_id'] = username
+                sess['username'] = username
+            start = time.perf_counter()
+            try:
+                response = make_request(client, username, group_id, thread_rng)
+                size = len(response.get_data())
+                ok = response.status_code < 400
+                error = None if ok else f'HTTP {response.status_code}'
+            except Exception as e:
+                ok, error = False, f'{type(e).__name__}: {e}'
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                    sizes.append(size)
+                    state['not_modified'] += response.status_code == 304
+                else:
+                    state['errors'] += 1
+                    state['first_error'] = state['first_error'] or error
+
+    threads = [threading.Thread(target=worker, args=(n, random.Random(rng.random()))) for n in per_thread]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, state['errors'], time.perf_counter() - start, state['first_error'],
+                     sizes, state['not_modified'])
+
+
+def login_request(flask_app):
+    def request(client, username, group_id, rng):
+        # A fresh client, so the login form is actually processed
+        return flask_app.test_client().post('/login', data={'username': username, 'password': PASSWORD})
+    return request
+
+
+def revalidate_request(path):
+    """Reload ``path`` with the ETag from the last response, like a browser revisiting a page.
+
+    Each client keeps to the first (user, group) it draws, so after its first
+    request it is revalidating a page it has already seen.
+    """
+    def request(client, username, group_id, rng):
+        if not hasattr(client, 'etag'):
+            client.pinned, client.etag = (username, group_id), None
+        username, group_id = client.pinned
+        with client.session_transaction() as sess:
+            sess['user_id'] = username
+            sess['username'] = username
+        headers = {'If-None-Match': client.etag} if client.etag else {}
+        response = client.get(path.format(group_id=group_id), headers=headers)
+        client.etag = response.headers.get('ETag', client.etag)
+        return response
+    return request
+
+
+def run_expiry_sweep(flask_app, args, rng):
+    """Expire --sweep-batch groups per round (untimed), then time one sweep."""
+    from bson.objectid import ObjectId
+    from expiry import sweep_expired_groups
+
+    db = studybuddy.services(flask_app).db
+    latencies = []
+    errors, first_error = 0, None
+    start_all = time.perf_counter()
+    for _ in range(args.sweep_rounds):
+        past = datetime.now() - timedelta(days=1)
+        group_ids = [ObjectId() for _ in range(args.sweep_batch)]
+        db.groups.insert_many([{'_id': gid, 'group_name': 'expired', 'subject': 'Math',
+                                'expiration_date': past, 'member_count': 1} for gid in group_ids])
+        db.memberships.insert_many([{'group_id': gid, 'username': 'user0', 'joined_at': past} for gid in group_ids])
+        db.messages.insert_many([{'group_id': gid, 'sender_name': 'user0', 'message_text': 'bye',
+                                  'timestamp': past} for gid in group_ids for _ in range(10)])
+        db.tasks.insert_many([{'group_id': gid, 'title': 't', 'completed': False, 'created_at': past}
+                              for gid in group_ids])
+        start = time.perf_counter()
+        try:
+            with flask_app.app_context():
+                sweep_expired_groups(db, studybuddy.delete_groups, batch_size=args.sweep_batch)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors += 1
+            first_error = first_error or f'{type(e).__name__}: {e}'
+    # Throughput here is sweeps per second
+    return summarize(latencies, errors, time.perf_counter() - start_all, first_error)
+
+
+def run_scenarios(flask_app, args, rng, pairs):
+    scenarios = {
+        'login': login_request(flask_app),
+        'index': lambda client, u, gid, r: client.get('/'),
+        'chat_get': lambda client, u, gid, r: client.get(f'/chat/{gid}'),
+        'chat_post': lambda client, u, gid, r: client.post(
+            f'/chat/{gid}', data={'message': 'benchmark message'}, headers={'X-Requested-With': 'XMLHttpRequest'}),
+        'tasks': lambda client, u, gid, r: client.get(f'/tasks/{gid}'),
+        'join_group': lambda client, u, gid, r: client.post(f'/join/{r.choice(pairs)[1]}'),
+        # Repeat views of pages that have not changed since the client's last view
+        'index_revalidate': revalidate_request('/'),
+        'chat_revalidate': revalidate_request('/chat/{group_id}'),
+        'tasks_revalidate': revalidate_request('/tasks/{group_id}'),
+    }
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        print(f'  {name}...', file=sys.stderr)
+        if name == 'expiry_sweep':
+            results[name] = run_expiry_sweep(flask_app, args, rng)
+        else:
+            results[name] = run_requests(flask_app, args, rng, pairs, scenarios[name])
+    return results
+
+
+def git_revision():
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                      stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], stderr=subprocess.DEVNULL,
+                                cwd=os.path.dirname(os.path.abspath(__file__))) != 0
+        return rev + ('-dirty' if dirty else '')
+    except Exception:
+        return None
+
+
+def fmt(value, digits=1):
+    return '-' if value is None else f'{value:.{digits}f}'
+
+
+def print_report(results, baseline=None):
+    header = (f"{'scenario':16} {'reqs':>6} {'err':>5} {'304':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+              f"{'req/s':>9} {'KB/resp':>8}")
+    if baseline:
+        header += f" {'p50 Δ':>8} {'p95 Δ':>8} {'bytes Δ':>8}"
+    print(header)
+    for name, r in results.items():
+        mean_kb = r['mean_bytes'] / 1024 if r.get('mean_bytes') is not None else None
+        line = (f"{name:16} {r['requests']:>6} {r['errors']:>5} {r.get('not_modified', 0):>5} {fmt(r['p50_ms']):>9} "
+                f"{fmt(r['p95_ms']):>9} {fmt(r['p99_ms']):>9} {fmt(r['throughput_rps']):>9} {fmt(mean_kb):>8}")
+        old = (baseline or {}).get(name)
+        if old:
+            for key in ('p50_ms', 'p95_ms', 'mean_bytes'):
+                if old.get(key) and r.get(key) is not None:
+                    line += f" {(r[key] - old[key]) / old[key] * 100:>+7.1f}%"
+                else:
+                    line += f" {'-':>8}"
+        print(line)
+        if r['errors'] and r.get('first_error'):
+            print(f"{'':16} first error: {r['first_error']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+
+    mongod = None
+    if args.spawn_mongod:
+        args.mongo_uri, mongod, mongod_dbpath = spawn_mongod(args.replica_set)
+    upload_folder = tempfile.mkdtemp(prefix='studybuddy-bench-uploads-')
+    try:
+        flask_app = load_app(args, upload_folder)
+        print('Seeding...', file=sys.stderr)
+        started = time.perf_counter()
+        pairs = seed(flask_app, args, rng)
+        print(f'Seeded in {time.perf_counter() - started:.1f}s; running scenarios', file=sys.stderr)
+        results = run_scenarios(flask_app, args, rng, pairs)
+    finally:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+        if mongod:
+            mongod.terminate()
+            mongod.wait()
+            shutil.rmtree(mongod_dbpath, ignore_errors=True)
+
+    report = {
+        'commit': git_revision(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'backend': 'mongomock' if args.backend == 'mongomock' else 'mongod',
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'mongo_uri')},
+        'results': results
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        baseline = old.get('results')
+        print(f"Compared with {old.get('commit')} ({old.get('created_at')})")
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Lazy, per-process MongoDB connection.
+
+A MongoClient is not fork-safe: one created at import time in the gunicorn
+master would hand the same sockets and monitor threads to every worker.
+``MongoConnection`` creates its client on first use, and again in any
+process other than the one that created it, so each worker gets its own
+pool. ``LazyDatabase`` stands in for a ``pymongo.database.Database`` and
+resolves through the connection on every access, so modules can hold on to
+``db`` at import time without opening a connection.
+
+A ``LazyDatabase`` can carry its own read preference, so one handle reads
+from the primary while another sends lag-tolerant reads to secondaries, and
+a ``session`` callable whose session every collection operation then runs
+in. With a causally consistent session shared by both handles, a read on a
+secondary waits until that secondary has caught up with the writes made
+earlier in the session (see request_session in app.py).
+"""
+from functools import partial
+import os
+import threading
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+
+# Collection methods that take a ``session`` argument and run a command
+SESSION_METHODS = frozenset([
+    'find', 'find_one', 'aggregate', 'count_documents', 'estimated_document_count', 'distinct',
+    'insert_one', 'insert_many', 'replace_one', 'update_one', 'update_many', 'delete_one', 'delete_many',
+    'bulk_write', 'find_one_and_update', 'find_one_and_delete', 'find_one_and_replace',
+])
+
+
+def read_preference(mode, max_staleness=-1):
+    """A pymongo read preference from a mode name such as 'secondaryPreferred'.
+
+    ``max_staleness`` (seconds, at least 90; -1 for no bound) keeps reads away
+    from secondaries lagging further behind the primary. Ignored for 'primary'.
+    """
+    mode = read_pref_mode_from_name(mode)
+    if mode == 0:  # primary takes no staleness bound
+        return make_read_preference(mode, None)
+    return make_read_preference(mode, None, max_staleness)
+
+
+class MongoConnection(object):
+    """One MongoClient per process, created on first use.
+
+    ``options`` are passed to MongoClient, e.g. maxPoolSize,
+    serverSelectionTimeoutMS or compressors.
+    """
+
+    def __init__(self, uri='mongodb://localhost:27017/', db_name='test', client_class=MongoClient, **options):
+        self.uri = uri
+        self.db_name = db_name
+        self.client_class = client_class
+        self.options = options
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, uri=None, db_name=None, **options):
+        """Change the settings; the next access connects with them."""
+        with self._lock:
+            if uri is not None:
+                self.uri = uri
+            if db_name is not None:
+                self.db_name = db_name
+            self.options.update(options)
+            self._close()
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    # A client inherited across fork is unusable; never close it
+                    # here, that would tear down the parent's sockets too
+                    self._client = self.client_class(self.uri, **self.options)
+                    self._pid = pid
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def start_session(self, **options):
+        return self.client.start_session(**options)
+
+    def ping(self):
+        """Round trip to the server. Raises a pymongo error if it is unreachable."""
+        return self.client.admin.command('ping')
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+        self._client = None
+        self._pid = None
+
+
+class SessionCollection(object):
+    """A Collection whose operations run in the session ``session()`` returns, if any."""
+
+    def __init__(self, collection, session):
+        self._collection = collection
+        self._session = session
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in SESSION_METHODS:
+            session = self._session()
+            if session is not None:
+                return partial(attr, session=session)
+        elif isinstance(attr, Collection):
+            return SessionCollection(attr, self._session)
+        return attr
+
+    def __getitem__(self, name):
+        return SessionCollection(self._collection[name], self._session)
+
+
+class LazyDatabase(object):
+    """Proxy for the connection's current Database.
+
+    ``options`` (read_preference, read_concern, ...) are passed to
+    ``MongoClient.get_database``. ``session``, if given, is called for each
+    collection operation and returns the session to run it in, or None.
+    """
+
+    def __init__(self, connection, session=None, **options):
+        self._connection = connection
+        self._session = session
+        self._options = options
+        self._cached = (None, None)
+
+    def configure(self, session=None, **options):
+        """Replace the options and session callable; the next access uses them."""
+        self._session = session
+        self._options = options
+        self._cached = (None, None)
+
+    @property
+    def database(self):
+        client = self._connection.client
+        cached_client, database = self._cached
+        # A new client after fork or configure() needs a new Database too
+        if cached_client is not client or database.name != self._connection.db_name:
+            database = client.get_database(self._connection.db_name, **self._options)
+            self._cached = (client, database)
+        return database
+
+    def __getattr__(self, name):
+        attr = getattr(self.database, name)
+        if self._session is not None and isinstance(attr, Collection):
+            return SessionCollection(attr, self._session)
+        return attr
+
+    def __getitem__(self, name):
+        collection = self.database[name]
+        if self._session is not None:
+            return SessionCollection(collection, self._session)
+        return collection
+
+    def __repr__(self):
+        return f'LazyDatabase({self._connection.db_name!r}, {self._options!r})'
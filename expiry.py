@@ -0,0 +1,97 @@
+"""Background reaping of expired study groups.
+
+Expired groups used to be deleted inline by the home page. The sweeper below
+does the same work off the request path, in bounded batches, and writes a
+summary of every run to ``db.sweep_runs``. Summaries hold counts and a
+bounded sample of the deleted group ids, and expire after 30 days (see the
+TTL index in indexes.py).
+"""
+from datetime import datetime
+import logging
+import threading
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_INTERVAL = 60  # seconds between sweeps
+GROUP_ID_SAMPLE_SIZE = 100  # deleted group ids kept per run summary
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_expired_groups(db, delete_groups, batch_size=DEFAULT_BATCH_SIZE, max_batches=None, now=None):
+    """Delete expired groups (and their files, messages and tasks) in batches.
+
+    ``delete_groups(group_ids)`` tears down one batch and returns a report
+    like ``teardown.teardown_groups``. Returns the summary document that was
+    recorded in ``db.sweep_runs``.
+    """
+    now = now or datetime.now()
+    started_at = datetime.now()
+    # Served by the expiration_date index; only the ids are needed
+    expired_filter = {'expiration_date': {'$lte': now}}
+
+    run = {
+        'started_at': started_at,
+        'expired_before': now,
+        'batches': 0,
+        'groups_deleted': 0,
+        'messages_deleted': 0,
+        'tasks_deleted': 0,
+        'files_deleted': 0,
+        # The first GROUP_ID_SAMPLE_SIZE ids; groups_deleted has the total
+        'group_ids_sample': []
+    }
+
+    while max_batches is None or run['batches'] < max_batches:
+        batch = [g['_id'] for g in db.groups.find(expired_filter, {'_id': 1}).limit(batch_size)]
+        if not batch:
+            break
+
+        report = delete_groups(batch)
+        run['batches'] += 1
+        run['groups_deleted'] += report['groups']
+        run['messages_deleted'] += report['messages']
+        run['tasks_deleted'] += report['tasks']
+        run['files_deleted'] += report['files_deleted']
+        room = GROUP_ID_SAMPLE_SIZE - len(run['group_ids_sample'])
+        run['group_ids_sample'].extend(batch[:max(room, 0)])
+
+        if len(batch) < batch_size:
+            break
+
+    run['finished_at'] = datetime.now()
+    if run['groups_deleted']:
+        db.sweep_runs.insert_one(dict(run))
+    return run
+
+
+class ExpirySweeper(object):
+    """Daemon thread that calls ``sweep_expired_groups`` every ``interval`` seconds."""
+
+    def __init__(self, db, delete_groups, interval=DEFAULT_INTERVAL, batch_size=DEFAULT_BATCH_SIZE):
+        self.db = db
+        self.delete_groups = delete_groups
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='expiry-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run(self):
+        """Sweep until ``stop()`` is called; blocks the calling thread."""
+        while not self._stop.is_set():
+            try:
+                sweep_expired_groups(self.db, self.delete_groups, batch_size=self.batch_size)
+            except Exception:
+                logger.exception('Expiry sweep failed')
+            self._stop.wait(self.interval)
@@ -0,0 +1,48 @@
+"""Cached subject facets for the home page filter dropdown."""
+from datetime import datetime
+import threading
+import time
+
+DEFAULT_TTL = 300  # seconds
+
+
+class SubjectFacetCache(object):
+    """Per-subject group counts, computed with one aggregation and cached.
+
+    Routes that add, edit or delete groups call ``invalidate()``. The TTL
+    bounds how stale other worker processes (and the expiry sweeper) can
+    leave the counts.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._facets = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, db):
+        """Return [(subject, group count), ...] sorted by subject."""
+        with self._lock:
+            if self._facets is not None and time.monotonic() < self._expires_at:
+                return self._facets
+
+        facets = self._compute(db)
+        with self._lock:
+            self._facets = facets
+            self._expires_at = time.monotonic() + self.ttl
+        return facets
+
+    def invalidate(self):
+        with self._lock:
+            self._facets = None
+
+    def _compute(self, db):
+        pipeline = [
+            {'$match': {
+                'subject': {'$nin': [None, '']},
+                '$or': [{'expiration_date': None}, {'expiration_date': {'$gt': datetime.now()}}]
+            }},
+            {'$group': {'_id': '$subject', 'count': {'$sum': 1}}},
+            {'$sort': {'_id': 1}}
+        ]
+        return [(f['_id'], f['count']) for f in db.groups.aggregate(pipeline)]
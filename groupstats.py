@@ -0,0 +1,155 @@
+"""Activity counters kept on each group document.
+
+The home page shows each group's activity without querying messages or
+tasks per card, so every group document carries::
+
+    {'member_count': 12, 'message_count': 340, 'task_count': 9,
+     'tasks_completed': 4, 'last_activity_at': datetime}
+
+Writers keep them in step with single ``$inc``/``$max`` updates that also
+bump the group's ``version``, which expires the rendered card (see
+render_fragment in app.py). ``member_count`` is maintained by
+membership.py. ``message_count`` includes archived messages.
+
+``reconcile`` rebuilds the counters from the collections in one aggregation
+that ``$merge``s its results back into ``db.groups`` (MongoDB 4.4 or later),
+for drift left by crashes, imports or manual edits.
+"""
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+STAT_FIELDS = ('member_count', 'message_count', 'task_count', 'tasks_completed', 'last_activity_at')
+
+
+def record_message(db, group_id, timestamp):
+    db.groups.update_one({'_id': group_id}, {
+        '$inc': {'message_count': 1, 'version': 1},
+        '$max': {'last_activity_at': timestamp}
+    })
+
+
+def record_tasks(db, group_id, added=0, completed=0):
+    """Count ``added`` tasks (negative when deleted) and ``completed`` ones (negative when reopened)."""
+    db.groups.update_one({'_id': group_id}, {
+        '$inc': {'task_count': added, 'tasks_completed': completed, 'version': 1},
+        '$max': {'last_activity_at': datetime.now()}
+    })
+
+
+def toggle_task(db, group_id, task_id, update):
+    """Apply a completed-toggling ``update`` to a task and count the change.
+
+    Returns the task's new completed state, or None if there is no such task.
+    """
+    task = db.tasks.find_one_and_update({'_id': task_id, 'group_id': group_id}, update,
+                                        projection={'completed': 1}, return_document=ReturnDocument.AFTER)
+    if task is None:
+        return None
+    record_tasks(db, group_id, completed=1 if task.get('completed') else -1)
+    return bool(task.get('completed'))
+
+
+def delete_task(db, task_filter):
+    """Delete the task matching ``task_filter`` and count it. Returns True if one was deleted."""
+    task = db.tasks.find_one_and_delete(task_filter, projection={'group_id': 1, 'completed': 1})
+    if task is None:
+        return False
+    record_tasks(db, task['group_id'], added=-1, completed=-1 if task.get('completed') else 0)
+    return True
+
+
+def recount_tasks(db, group_id):
+    """Set a group's task counters from its tasks, after writes too mixed to count one by one."""
+    rows = list(db.tasks.aggregate([
+        {'$match': {'group_id': group_id}},
+        {'$group': {'_id': None, 'count': {'$sum': 1},
+                    'completed': {'$sum': {'$cond': [{'$eq': ['$completed', True]}, 1, 0]}}}}
+    ]))
+    count, completed = (rows[0]['count'], rows[0]['completed']) if rows else (0, 0)
+    db.groups.update_one({'_id': group_id}, {
+        '$set': {'task_count': count, 'tasks_completed': completed},
+        '$inc': {'version': 1},
+        '$max': {'last_activity_at': datetime.now()}
+    })
+
+
+def _lookup(collection, name, group):
+    """$lookup the group's documents in ``collection`` reduced by a $group stage."""
+    return {'$lookup': {
+        'from': collection,
+        'let': {'group_id': '$_id'},
+        'pipeline': [{'$match': {'$expr': {'$eq': ['$group_id', '$$group_id']}}},
+                     {'$group': dict({'_id': None}, **group)}],
+        'as': name
+    }}
+
+
+def _first(path, default=None):
+    value = {'$arrayElemAt': [path, 0]}
+    return value if default is None else {'$ifNull': [value, default]}
+
+
+def reconcile_pipeline(group_ids=None):
+    """The aggregation that recomputes the counters and merges them into db.groups.
+
+    A group's version is bumped only if one of its counters changes, and
+    last_activity_at never moves backwards (task toggles leave no timestamp
+    to recompute it from).
+    """
+    computed = {
+        'member_count': _first('$members.count', 0),
+        'message_count': {'$add': [_first('$messages.count', 0), _first('$archived.count', 0)]},
+        'task_count': _first('$tasks.count', 0),
+        'tasks_completed': _first('$tasks.completed', 0),
+        # $max skips missing values
+        'last_activity_at': {'$max': [_first('$messages.last'), _first('$archived.last'), _first('$tasks.last')]},
+    }
+    merged = {field: '$$new.' + field for field in STAT_FIELDS}
+    merged['last_activity_at'] = {'$max': ['$last_activity_at', '$$new.last_activity_at']}
+    changed = {'$ne': [[f'${field}' for field in STAT_FIELDS], [merged[field] for field in STAT_FIELDS]]}
+
+    return [
+        {'$match': {'_id': {'$in': list(group_ids)}} if group_ids is not None else {}},
+        {'$project': {'_id': 1}},
+        _lookup('memberships', 'members', {'count': {'$sum': 1}}),
+        _lookup('messages', 'messages', {'count': {'$sum': 1}, 'last': {'$max': '$timestamp'}}),
+        _lookup('message_archive', 'archived', {'count': {'$sum': '$count'}, 'last': {'$max': '$last_ts'}}),
+        _lookup('tasks', 'tasks', {'count': {'$sum': 1},
+                                   'completed': {'$sum': {'$cond': [{'$eq': ['$completed', True]}, 1, 0]}},
+                                   'last': {'$max': '$created_at'}}),
+        {'$project': computed},
+        {'$merge': {
+            'into': 'groups',
+            'on': '_id',
+            'whenMatched': [
+                {'$set': {'version': {'$cond': [changed, {'$add': [{'$ifNull': ['$version', 0]}, 1]}, '$version']}}},
+                {'$set': merged}
+            ],
+            'whenNotMatched': 'discard'
+        }}
+    ]
+
+
+def reconcile(db, group_ids=None, batch_size=500):
+    """Rebuild the counters of ``group_ids`` (default: every group), ``batch_size`` groups per aggregation.
+
+    Returns the number of groups processed.
+    """
+    if group_ids is not None:
+        group_ids = list(group_ids)
+        for start in range(0, len(group_ids), batch_size):
+            db.groups.aggregate(reconcile_pipeline(group_ids[start:start + batch_size]))
+        return len(group_ids)
+
+    # Batches by _id so each aggregation stays short and the merge sees a stable set
+    processed = 0
+    after = None
+    while True:
+        query = {'_id': {'$gt': after}} if after else {}
+        ids = [g['_id'] for g in db.groups.find(query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            return processed
+        db.groups.aggregate(reconcile_pipeline(ids))
+        processed += len(ids)
+        after = ids[-1]
@@ -0,0 +1,54 @@
+# gunicorn settings for StudyBuddy:
+#   gunicorn 'app:create_app()'
+#
+# Every setting can be overridden from the environment so different worker
+# layouts can be benchmarked without editing this file, e.g.
+#   GUNICORN_WORKERS=4 GUNICORN_THREADS=16 gunicorn 'app:create_app()'
+#   GUNICORN_WORKER_CLASS=gevent gunicorn 'app:create_app()'   # pip install gevent
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Requests mostly wait on MongoDB and password hashing (which releases the
+# GIL), so a few processes with many threads each go further than many
+# single-threaded processes. Chat streams (SSE) hold a thread for as long as
+# the page is open; size GUNICORN_THREADS for open chat tabs, or use gevent.
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))  # gevent only
+
+# Each worker has its own password hashing pool (see hashing.py); share the
+# CPUs between them so a burst of logins cannot run workers x CPUs hashes
+os.environ.setdefault('HASH_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+# Import the app once in the master and fork it. Safe because the MongoDB
+# client is created lazily in each worker (see database.py). gevent must
+# patch the standard library before the app is imported, so it skips this.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+
+# Longer than the chat stream heartbeat (15s), so idle streams are not killed
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+
+
+def when_ready(server):
+    # The in-process chat broker only reaches members connected to the poster's worker
+    if workers > 1 and os.environ.get('CHAT_BROKER') == 'memory':
+        server.log.warning('CHAT_BROKER=memory with %d workers: live chat only reaches members '
+                           'on the same worker; use poll or changestream', workers)
+
+
+def post_worker_init(worker):
+    # Open this worker's MongoDB pool before it accepts requests
+    from app import warm_up
+    warm_up(worker.wsgi)
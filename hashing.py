@@ -0,0 +1,99 @@
+"""Password hashing on a bounded worker pool.
+
+Hashing is deliberately slow and CPU-bound. Running it on a small pool keeps
+a burst of logins from occupying every request thread; when the pool and its
+queue are full, callers get ``HasherBusy`` right away instead of waiting.
+hashlib's scrypt and pbkdf2 release the GIL, so the pool threads hash in
+parallel with request handling.
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+import time
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'scrypt'
+
+
+class HasherBusy(Exception):
+    """The hashing pool is saturated; retry after ``retry_after`` seconds."""
+
+    def __init__(self, retry_after=1):
+        super().__init__('Password hashing pool is saturated')
+        self.retry_after = retry_after
+
+
+class PasswordHasher(object):
+    """Hash and verify passwords on at most ``max_workers`` threads.
+
+    At most ``max_pending`` more requests may wait for a thread. ``method``
+    is any werkzeug hash method, e.g. 'scrypt:32768:8:1' or
+    'pbkdf2:sha256:600000'.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, max_workers=2, max_pending=16, timeout=10, retry_after=2):
+        self.method = method
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._prefixes = {}
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if ``password_hash`` was made with different parameters than ``method``."""
+        return password_hash.split('$', 1)[0] != self._prefix(self.method)
+
+    @property
+    def in_flight(self):
+        """Hashes running or queued right now."""
+        return self._in_flight
+
+    def _prefix(self, method):
+        # werkzeug fills in default parameters ('scrypt' -> 'scrypt:32768:8:1'),
+        # so hash once to learn the full prefix it writes
+        if method not in self._prefixes:
+            self._prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+        return self._prefixes[method]
+
+    def _run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy(self.retry_after)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hasher')
+            self._in_flight += 1
+
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy(self.retry_after)
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+
+def benchmark(methods, rounds=5):
+    """Time werkzeug hash methods. Returns [(method, seconds per hash), ...]."""
+    results = []
+    for method in methods:
+        generate_password_hash('warm-up', method=method)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            generate_password_hash('benchmark-password', method=method)
+        results.append((method, (time.perf_counter() - start) / rounds))
+    return results
@@ -0,0 +1,132 @@
+"""Index declarations for every collection the app queries.
+
+``ensure_indexes`` is idempotent: MongoDB skips indexes that already exist with
+the same keys and options, so it is safe to run at every startup.
+``coverage_report`` runs ``explain`` on the app's hot queries and reports
+whether each one is served by an index.
+"""
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from bson.objectid import ObjectId
+
+# collection name -> indexes on that collection
+INDEXES = {
+    'users': [
+        # login/register lookups; unique so two concurrent registrations
+        # of the same username cannot both succeed
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+    ],
+    'groups': [
+        # expiry sweeper and the "not yet expired" filter on the home page
+        IndexModel([('expiration_date', ASCENDING)], name='expiration_date'),
+        # subject filter on the home page, paged in _id order
+        IndexModel([('subject', ASCENDING), ('_id', ASCENDING)], name='subject_id'),
+        # search; a collection can have only one text index
+        IndexModel([('group_name', TEXT), ('course_number', TEXT), ('description', TEXT)], name='group_text',
+                   weights={'group_name': 10, 'course_number': 5, 'description': 1}),
+    ],
+    'memberships': [
+        # membership checks; unique so joining twice is a no-op
+        IndexModel([('group_id', ASCENDING), ('username', ASCENDING)], name='group_username', unique=True),
+        # "my groups", most recently joined first
+        IndexModel([('username', ASCENDING), ('_id', DESCENDING)], name='username_id'),
+    ],
+    'messages': [
+        # chat history, oldest first; _id breaks ties between equal timestamps
+        IndexModel([('group_id', ASCENDING), ('timestamp', ASCENDING), ('_id', ASCENDING)],
+                   name='group_timestamp'),
+        # attachment authorization: is this file attached to a message in the group?
+        IndexModel([('group_id', ASCENDING), ('file_hash', ASCENDING)], name='group_file_hash',
+                   partialFilterExpression={'file_hash': {'$exists': True}}),
+        # search
+        IndexModel([('message_text', TEXT)], name='message_text'),
+    ],
+    'message_archive': [
+        # older chat pages: a group's bundles, newest first (see archive.py)
+        IndexModel([('group_id', ASCENDING), ('last_ts', DESCENDING), ('last_id', DESCENDING)],
+                   name='group_last'),
+        # attachment authorization for archived messages (multikey)
+        IndexModel([('group_id', ASCENDING), ('file_hashes', ASCENDING)], name='group_file_hashes'),
+    ],
+    'sweep_runs': [
+        # sweeper run summaries are only kept for a month
+        IndexModel([('finished_at', ASCENDING)], name='finished_at_ttl', expireAfterSeconds=30 * 24 * 60 * 60),
+    ],
+    'blobs': [
+        # garbage collection of unreferenced attachments
+        IndexModel([('refcount', ASCENDING)], name='refcount'),
+    ],
+    'tasks': [
+        # task list, newest first
+        IndexModel([('group_id', ASCENDING), ('created_at', DESCENDING)], name='group_created_at'),
+        # search
+        IndexModel([('title', TEXT), ('description', TEXT)], name='task_text',
+                   weights={'title': 5, 'description': 1}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create any missing indexes. Returns {collection: [index names]}."""
+    created = {}
+    for collection, models in INDEXES.items():
+        created[collection] = db[collection].create_indexes(models)
+    return created
+
+
+def _hot_queries(db):
+    """(description, cursor) pairs for the queries the routes run most often."""
+    oid = ObjectId()
+    now = datetime.now()
+    return [
+        ('users by username (login/register)',
+         db.users.find({'username': 'example'})),
+        ('groups visible on the home page',
+         db.groups.find({'$or': [{'expiration_date': None}, {'expiration_date': {'$gt': now}}],
+                         '_id': {'$gt': oid}}).sort('_id', 1).limit(25)),
+        ('groups by subject (home page filter)',
+         db.groups.find({'subject': 'Math', '_id': {'$gt': oid}}).sort('_id', 1).limit(25)),
+        ('expired groups (sweeper)',
+         db.groups.find({'expiration_date': {'$lte': now}}, {'_id': 1})),
+        ('membership check',
+         db.memberships.find({'group_id': oid, 'username': 'example'}, {'_id': 1})),
+        ('groups of a user ("my groups")',
+         db.memberships.find({'username': 'example'}).sort('_id', -1).limit(20)),
+        ('chat history for a group',
+         db.messages.find({'group_id': oid}).sort('timestamp', 1)),
+        ('archived chat history for a group',
+         db.message_archive.find({'group_id': oid, 'first_ts': {'$lt': now}}).sort([('last_ts', -1), ('last_id', -1)])),
+        ('task list for a group',
+         db.tasks.find({'group_id': oid}).sort('created_at', -1)),
+    ]
+
+
+def _plan_stages(plan):
+    """Yield every stage name in a winning plan tree."""
+    if not plan:
+        return
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+def coverage_report(db):
+    """Explain each hot query and return a list of result dicts.
+
+    Each dict has the query ``description``, the winning plan ``stages`` and
+    whether the query is ``covered`` (uses an index and never scans the
+    whole collection).
+    """
+    report = []
+    for description, cursor in _hot_queries(db):
+        plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+        stages = [s for s in _plan_stages(plan) if s]
+        report.append({
+            'description': description,
+            'stages': stages,
+            'covered': 'COLLSCAN' not in stages and any(s in ('IXSCAN', 'IDHACK', 'EXPRESS_IXSCAN') for s in stages)
+        })
+    return report
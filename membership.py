@@ -0,0 +1,108 @@
+"""Group membership, one document per member in ``db.memberships``.
+
+Membership documents look like::
+
+    {'_id': ObjectId, 'group_id': ObjectId, 'username': 'alice', 'joined_at': datetime}
+
+The unique (group_id, username) index makes a membership check a single
+index probe and keeps joins idempotent; the (username, _id) index serves the
+"my groups" page. Each group document carries a denormalised
+``member_count`` that add_member/remove_member keep in step, bumping the
+group's ``version`` as they do.
+"""
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+
+def is_member(db, group_id, username):
+    return db.memberships.find_one({'group_id': group_id, 'username': username}, {'_id': 1}) is not None
+
+
+def add_member(db, group_id, username):
+    """Add ``username`` to the group. Returns False if already a member."""
+    try:
+        db.memberships.insert_one({'group_id': group_id, 'username': username, 'joined_at': datetime.now()})
+    except DuplicateKeyError:
+        return False
+    db.groups.update_one({'_id': group_id}, {'$inc': {'member_count': 1, 'version': 1}})
+    return True
+
+
+def remove_member(db, group_id, username):
+    """Remove ``username`` from the group. Returns False if not a member."""
+    result = db.memberships.delete_one({'group_id': group_id, 'username': username})
+    if not result.deleted_count:
+        return False
+    db.groups.update_one({'_id': group_id}, {'$inc': {'member_count': -1, 'version': 1}})
+    return True
+
+
+def list_members(db, group_id):
+    """Usernames of a group's members, alphabetically."""
+    cursor = db.memberships.find({'group_id': group_id}, {'username': 1, '_id': 0}).sort('username', 1)
+    return [m['username'] for m in cursor]
+
+
+def members_among(db, group_id, usernames):
+    """The subset of ``usernames`` who belong to the group, in one query."""
+    cursor = db.memberships.find({'group_id': group_id, 'username': {'$in': list(usernames)}}, {'username': 1})
+    return {m['username'] for m in cursor}
+
+
+def groups_among(db, username, group_ids):
+    """The subset of ``group_ids`` that ``username`` belongs to, in one query."""
+    cursor = db.memberships.find({'username': username, 'group_id': {'$in': list(group_ids)}}, {'group_id': 1})
+    return {m['group_id'] for m in cursor}
+
+
+def user_memberships(db, username, before=None, limit=20):
+    """One page of a user's memberships, most recently joined first.
+
+    ``before`` is the _id of the last membership on the previous page.
+    """
+    query = {'username': username}
+    if before:
+        query['_id'] = {'$lt': before}
+    return list(db.memberships.find(query, {'group_id': 1, 'joined_at': 1}).sort('_id', -1).limit(limit))
+
+
+def migrate_embedded_members(db, batch_size=500):
+    """Move ``members`` arrays from group documents into ``db.memberships``.
+
+    Idempotent and resumable: memberships are upserted, and a group's array
+    is only removed once its memberships and member_count are written.
+    Returns (groups migrated, memberships upserted).
+    """
+    groups_migrated = 0
+    upserted = 0
+    while True:
+        groups = list(db.groups.find({'members': {'$exists': True}}, {'members': 1}).limit(batch_size))
+        if not groups:
+            break
+
+        writes = []
+        for group in groups:
+            for username in set(group.get('members') or []):
+                writes.append(UpdateOne(
+                    {'group_id': group['_id'], 'username': username},
+                    {'$setOnInsert': {'joined_at': group['_id'].generation_time.replace(tzinfo=None)}},
+                    upsert=True
+                ))
+        if writes:
+            upserted += db.memberships.bulk_write(writes, ordered=False).upserted_count
+
+        # Recount from the memberships collection so reruns stay correct
+        counts = dict((c['_id'], c['count']) for c in db.memberships.aggregate([
+            {'$match': {'group_id': {'$in': [g['_id'] for g in groups]}}},
+            {'$group': {'_id': '$group_id', 'count': {'$sum': 1}}}
+        ]))
+        db.groups.bulk_write([
+            UpdateOne({'_id': g['_id']}, {'$set': {'member_count': counts.get(g['_id'], 0)},
+                                          '$unset': {'members': ''}, '$inc': {'version': 1}})
+            for g in groups
+        ], ordered=False)
+        groups_migrated += len(groups)
+
+    return groups_migrated, upserted
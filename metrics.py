@@ -0,0 +1,247 @@
+"""Request timing and MongoDB command instrumentation.
+
+Counters and histograms live in a ``Registry`` and are rendered in the
+Prometheus text format for the /metrics endpoint. Like the caches, the
+numbers are per worker process; scrape each worker, or run one worker per
+container.
+
+``MongoCommandMetrics`` is a ``pymongo.monitoring.CommandListener``. It times
+every command, keeps a per-thread tally so a request can report how many
+commands it ran and how long they took, and logs commands slower than a
+threshold with the shape of their filter (values replaced by their type, so
+no user data reaches the log).
+"""
+from bisect import bisect_left
+import logging
+import threading
+import time
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram(object):
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        """Context manager that observes the seconds spent in its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for key, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                yield self.name + '_bucket', _format_labels(self.labels + ('le',), key + (le,)), cumulative
+            yield self.name + '_sum', _format_labels(self.labels, key), counts[-1]
+            yield self.name + '_count', _format_labels(self.labels, key), cumulative
+
+
+class Gauge(object):
+    """Values read from ``collect()`` at scrape time.
+
+    ``collect`` returns an iterable of (label values tuple, value). Pass
+    ``kind='counter'`` for totals kept elsewhere, such as cache hit counts.
+    """
+
+    def __init__(self, name, help, labels, collect, kind='gauge'):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in self.collect():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        self.histogram.observe(self.seconds, **self.labels)
+
+
+class Registry(object):
+    """A named set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels, collect, kind='gauge'):
+        return self.register(Gauge(name, help, labels, collect, kind))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def query_shape(value):
+    """Replace the values in a filter with their type names.
+
+    ``{'group_id': ObjectId(..), 'timestamp': {'$lt': datetime}}`` becomes
+    ``{'group_id': 'ObjectId', 'timestamp': {'$lt': 'datetime'}}``.
+    """
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Long $in lists collapse to the shape of their first element
+        return [query_shape(value[0])] if value else []
+    return type(value).__name__
+
+
+# Where each command keeps the part worth logging
+_SHAPE_FIELDS = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'delete': 'deletes',
+    'update': 'updates',
+    'findAndModify': 'query',
+    'aggregate': 'pipeline',
+}
+
+# Replies to these are not application queries
+_IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'saslStart', 'saslContinue', 'endSessions'}
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Time MongoDB commands, tally them per thread and log slow ones."""
+
+    def __init__(self, registry, slow_ms=100):
+        self.slow_ms = slow_ms
+        self.duration = registry.histogram(
+            'mongo_command_duration_seconds', 'MongoDB command latency.', ('command', 'collection'))
+        self.failures = registry.counter(
+            'mongo_command_failures_total', 'MongoDB commands that returned an error.', ('command', 'collection'))
+        self._pending = {}
+        self._local = threading.local()
+
+    def begin(self):
+        """Start a fresh per-thread tally (call at the start of a request)."""
+        self._local.count = 0
+        self._local.seconds = 0.0
+
+    def tally(self):
+        """(commands, seconds) run on this thread since ``begin``."""
+        return getattr(self._local, 'count', 0), getattr(self._local, 'seconds', 0.0)
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        shape_field = _SHAPE_FIELDS.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else '',
+            command.get(shape_field) if shape_field else None
+        )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        collection, shape_source = pending
+        seconds = event.duration_micros / 1e6
+        self.duration.observe(seconds, command=event.command_name, collection=collection)
+        if failed:
+            self.failures.inc(command=event.command_name, collection=collection)
+        if hasattr(self._local, 'count'):
+            self._local.count += 1
+            self._local.seconds += seconds
+        if seconds * 1000 >= self.slow_ms:
+            logger.warning('Slow MongoDB %s on %s: %.1f ms %s', event.command_name, collection,
+                           seconds * 1000, query_shape(shape_source) if shape_source is not None else '')
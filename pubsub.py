@@ -0,0 +1,224 @@
+"""Publish/subscribe fan-out for live chat updates.
+
+Each broker delivers events to the subscribers of a channel (one channel per
+group) connected to *this* process:
+
+- ``InProcessBroker``: ``publish`` fans out directly. Only correct with a
+  single worker process.
+- ``ChangeStreamBroker``: every worker watches ``db.messages`` inserts through
+  a MongoDB change stream, so a post handled by one worker reaches members
+  connected to any other. Needs a replica set.
+- ``PollingBroker``: stand-in for the change stream on a standalone mongod; a
+  thread per worker polls for new messages by ``_id``.
+
+For the Mongo-backed brokers ``publish`` is a no-op: the watcher thread sees
+the insert and fans it out, so nothing is delivered twice.
+
+``add_listener`` registers a callback for every message document a watcher
+thread sees, whether or not anyone is subscribed; the recent-message buffer
+uses it to pick up posts handled by other workers. Listeners call ``watch``
+from the worker to start the thread, as a subscription would.
+"""
+from collections import deque
+from datetime import datetime, timedelta
+import logging
+import queue
+import threading
+import time
+
+from bson.objectid import ObjectId
+
+DEFAULT_QUEUE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    """A subscriber's bounded event queue.
+
+    If the subscriber falls behind and the queue fills up, further events are
+    dropped and ``overflowed`` is set; the stream should then be closed so the
+    client reconnects and catches up from the database.
+    """
+
+    def __init__(self, broker, channel, maxsize=DEFAULT_QUEUE_SIZE):
+        self.broker = broker
+        self.channel = channel
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """Next event, or None if nothing arrived within ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker(object):
+    """Fans events out to subscribers in the current process."""
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._channels = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """Call ``callback(doc)`` for new message documents seen by a watcher thread.
+
+        This broker has no watcher: the posting request is the only place a
+        message shows up, so the callback is never called.
+        """
+        self._listeners.append(callback)
+
+    def watch(self):
+        """Make sure this process's watcher thread is running (listeners need it)."""
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(s) for s in self._channels.values())
+
+    def publish(self, channel, event):
+        self._fanout(channel, event)
+
+    def _fanout(self, channel, event):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+class _WatcherBroker(InProcessBroker):
+    """Base for brokers fed by a background thread reading ``db.messages``.
+
+    ``to_event(doc)`` turns an inserted message document into a
+    ``(channel, event)`` pair. The thread is started on the first subscription
+    so that it is created in the worker process, after any fork.
+    """
+
+    def __init__(self, db, to_event, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(queue_size)
+        self.db = db
+        self.to_event = to_event
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def subscribe(self, channel):
+        self._ensure_thread()
+        return super().subscribe(channel)
+
+    def watch(self):
+        self._ensure_thread()
+
+    def publish(self, channel, event):
+        # Delivered by the watcher thread once it sees the insert
+        pass
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._watch, name=type(self).__name__, daemon=True)
+                self._thread.start()
+
+    def _deliver(self, doc):
+        for callback in self._listeners:
+            try:
+                callback(doc)
+            except Exception:
+                logger.exception('Chat listener failed')
+        channel, event = self.to_event(doc)
+        self._fanout(channel, event)
+
+    def _watch(self):
+        raise NotImplementedError
+
+
+class ChangeStreamBroker(_WatcherBroker):
+    """Delivers inserts seen on a ``db.messages`` change stream."""
+
+    def _watch(self):
+        resume_token = None
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        while True:
+            try:
+                with self.db.messages.watch(pipeline, resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        self._deliver(change['fullDocument'])
+            except Exception:
+                logger.exception('Chat change stream failed, retrying')
+                time.sleep(1)
+
+
+class PollingBroker(_WatcherBroker):
+    """Polls ``db.messages`` for new inserts while anyone is subscribed or listening.
+
+    ObjectIds are generated by the inserting worker, so a message can become
+    visible with an _id slightly below one already seen. Each poll therefore
+    looks back ``overlap`` seconds and skips ids it has already delivered.
+    """
+
+    def __init__(self, db, to_event, interval=1.0, overlap=5, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(db, to_event, queue_size)
+        self.interval = interval
+        self.overlap = overlap
+
+    def _watch(self):
+        since = datetime.utcnow()
+        delivered = deque(maxlen=1000)
+        delivered_ids = set()
+        while True:
+            time.sleep(self.interval)
+            if not self.subscriber_count() and not self._listeners:
+                since = datetime.utcnow()
+                continue
+            try:
+                lower = ObjectId.from_datetime(since - timedelta(seconds=self.overlap))
+                for doc in self.db.messages.find({'_id': {'$gt': lower}}).sort('_id', 1):
+                    if doc['_id'] in delivered_ids:
+                        continue
+                    if len(delivered) == delivered.maxlen:
+                        delivered_ids.discard(delivered[0])
+                    delivered.append(doc['_id'])
+                    delivered_ids.add(doc['_id'])
+                    since = max(since, doc['_id'].generation_time.replace(tzinfo=None))
+                    self._deliver(doc)
+            except Exception:
+                logger.exception('Chat polling failed')
+
+
+def create_broker(kind, db=None, to_event=None):
+    """Build a broker by name: 'memory', 'changestream' or 'poll'."""
+    if kind == 'memory':
+        return InProcessBroker()
+    if kind == 'changestream':
+        return ChangeStreamBroker(db, to_event)
+    if kind == 'poll':
+        return PollingBroker(db, to_event)
+    raise ValueError(f'Unknown chat broker: {kind}')
@@ -0,0 +1,234 @@
+"""Token-bucket rate limits and concurrency caps.
+
+A ``Bucket`` holds up to ``capacity`` tokens and refills at ``rate`` tokens
+per second; each request takes ``cost`` tokens (1 per message, or the body
+size for byte budgets). ``RateLimiter.take`` checks several buckets at once,
+e.g. the poster's, the group's and the client IP's, and only spends tokens
+when all of them have enough. ``RateLimiter.slot`` caps how many requests
+per key run at the same time.
+
+Limits are checked from the request line and headers alone, so a rejected
+request costs no body read, no upload and no database work.
+
+- ``MemoryBackend`` keeps the state in this process, so each worker
+  enforces the limits separately.
+- ``RedisBackend`` keeps it in Redis, shared by every worker. Needs the
+  ``redis`` package.
+"""
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+DEFAULT_MAX_KEYS = 100000
+SLOT_RETRY_AFTER = 2  # seconds
+SLOT_TTL = 300  # a crashed worker's Redis slots free themselves after this
+
+Bucket = namedtuple('Bucket', 'name key rate capacity cost')
+
+
+def per_minute(name, key, count, cost=1):
+    """A bucket allowing ``count`` per minute, all of them in a burst if saved up."""
+    return Bucket(name, key, count / 60.0, count, cost)
+
+
+class RateLimited(Exception):
+    """A limit was hit; retry after ``retry_after`` seconds."""
+
+    def __init__(self, limit, retry_after):
+        super().__init__(f'Rate limit exceeded: {limit}')
+        self.limit = limit
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class MemoryBackend(object):
+    """Bucket and slot state in this process.
+
+    At most ``max_keys`` buckets are kept; the least recently used are
+    dropped, which only ever refills them early.
+    """
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets, now):
+        """Spend every bucket's cost, or none. Returns (bucket that is short, wait)."""
+        with self._lock:
+            levels = []
+            short, wait = None, 0.0
+            for bucket in buckets:
+                tokens, updated = self._buckets.get(bucket.key, (bucket.capacity, now))
+                tokens = min(bucket.capacity, tokens + max(0.0, now - updated) * bucket.rate)
+                cost = min(bucket.cost, bucket.capacity)
+                if tokens < cost and (cost - tokens) / bucket.rate > wait:
+                    short, wait = bucket, (cost - tokens) / bucket.rate
+                levels.append(tokens - cost)
+            if short is not None:
+                return short, wait
+            for bucket, tokens in zip(buckets, levels):
+                self._buckets[bucket.key] = (tokens, now)
+                self._buckets.move_to_end(bucket.key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return None, 0.0
+
+    def acquire(self, key, limit):
+        with self._lock:
+            if self._slots.get(key, 0) >= limit:
+                return False
+            self._slots[key] = self._slots.get(key, 0) + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            count = self._slots.get(key, 0) - 1
+            if count > 0:
+                self._slots[key] = count
+            else:
+                self._slots.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'buckets': len(self._buckets), 'slots_in_use': sum(self._slots.values())}
+
+
+# Check every bucket in KEYS; spend from all of them only if each has enough.
+# ARGV: now, then (rate, capacity, cost) per key. Returns '0' or
+# '<index of the short bucket> <seconds to wait>'.
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local short, wait = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local capacity = tonumber(ARGV[i * 3])
+    local cost = math.min(tonumber(ARGV[i * 3 + 1]), capacity)
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    if tokens < cost and (cost - tokens) / rate > wait then
+        short, wait = i, (cost - tokens) / rate
+    end
+    levels[i] = tokens - cost
+end
+if short > 0 then
+    return tostring(short - 1) .. ' ' .. tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local capacity = tonumber(ARGV[i * 3])
+    redis.call('HSET', key, 'tokens', tostring(levels[i]), 'updated', ARGV[1])
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return '0'
+"""
+
+_ACQUIRE_SCRIPT = """
+local n = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if n > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+return 1
+"""
+
+# Give back a slot. The count may already be gone if it outlived SLOT_TTL,
+# so never take it below zero.
+_RELEASE_SCRIPT = """
+local n = tonumber(redis.call('GET', KEYS[1]) or '0')
+if n > 1 then
+    redis.call('DECR', KEYS[1])
+else
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+
+class RedisBackend(object):
+    """Bucket and slot state in Redis, shared by all workers.
+
+    Uses the callers' clocks, so keep worker hosts NTP-synced.
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+        self.prefix = prefix
+
+    def take(self, buckets, now):
+        args = [repr(now)]
+        for bucket in buckets:
+            args += [repr(bucket.rate), repr(bucket.capacity), repr(bucket.cost)]
+        result = self._take(keys=[self.prefix + b.key for b in buckets], args=args)
+        if result in (b'0', '0'):
+            return None, 0.0
+        index, wait = result.split()
+        return buckets[int(index)], float(wait)
+
+    def acquire(self, key, limit):
+        return bool(self._acquire(keys=[self.prefix + 'slot:' + key], args=[limit, SLOT_TTL]))
+
+    def release(self, key):
+        self._release(keys=[self.prefix + 'slot:' + key])
+
+    def stats(self):
+        return {}
+
+
+class RateLimiter(object):
+    """Token buckets and concurrency slots on a backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def take(self, *buckets):
+        """Spend from every bucket, or raise RateLimited naming the one that is short."""
+        buckets = [b for b in buckets if b is not None and b.capacity > 0]
+        if not buckets:
+            return
+        short, wait = self.backend.take(buckets, time.time())
+        if short is not None:
+            raise RateLimited(short.name, wait)
+
+    @contextmanager
+    def slot(self, *limits):
+        """Hold one slot per (name, key, limit) for the block, or raise RateLimited."""
+        held = []
+        try:
+            for name, key, limit in limits:
+                if not limit:
+                    continue
+                if not self.backend.acquire(key, limit):
+                    raise RateLimited(name, SLOT_RETRY_AFTER)
+                held.append(key)
+            yield
+        finally:
+            for key in held:
+                self.backend.release(key)
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def create_rate_limiter(kind, redis_url=None):
+    """Build a limiter by name: 'memory', 'redis' or 'off' (returns None)."""
+    if kind == 'off':
+        return None
+    if kind == 'memory':
+        return RateLimiter(MemoryBackend())
+    if kind == 'redis':
+        if not redis_url:
+            raise ValueError('RATE_LIMITS=redis needs REDIS_URL')
+        return RateLimiter(RedisBackend(redis_url))
+    raise ValueError(f'Unknown rate limit backend: {kind}')
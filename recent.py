@@ -0,0 +1,322 @@
+"""The newest messages of busy groups, kept out of Mongo's way.
+
+Opening a chat only shows the newest page of messages, so each group's
+newest ``per_group`` messages are buffered: filled from Mongo on a miss and
+appended to whenever a message is posted. A page that fits in the buffer is
+served without a query.
+
+- ``RecentMessages`` keeps the buffers in this process, bounded by a global
+  ``max_bytes``; the least recently used groups are evicted first. Posts
+  handled by other workers only arrive through a watcher-backed chat broker
+  (changestream or poll, see pubsub.py), so create_recent_messages() refuses
+  it with the in-process broker. Buffers are refilled after ``ttl`` seconds
+  in any case, which bounds how long a missed delivery can go unseen.
+- ``RedisRecentMessages`` keeps them in Redis, shared by every worker.
+  Needs the ``redis`` package.
+
+Buffered documents hold the ``fields`` the chat page needs plus ``_id``,
+with timestamps truncated to the millisecond Mongo stores, so cursors built
+from them match the database.
+"""
+from bisect import insort
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+DEFAULT_PER_GROUP = 100
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 30  # seconds
+ENTRY_OVERHEAD = 400  # rough size of a small message dict and its values
+
+
+def _sort_key(doc):
+    return doc['timestamp'], doc['_id']
+
+
+def _trim(doc, fields):
+    trimmed = {k: doc[k] for k in fields if doc.get(k) is not None}
+    timestamp = trimmed['timestamp']
+    trimmed['timestamp'] = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+    return trimmed
+
+
+def _doc_size(doc):
+    return ENTRY_OVERHEAD + sum(len(v) for v in doc.values() if isinstance(v, str))
+
+
+class _Buffer(object):
+
+    __slots__ = ('docs', 'has_older', 'bytes', 'expires_at')
+
+    def __init__(self, docs, has_older, expires_at):
+        self.docs = docs  # oldest first
+        self.has_older = has_older
+        self.bytes = sum(_doc_size(d) for d in docs)
+        self.expires_at = expires_at
+
+
+class RecentMessages(object):
+    """Per-group buffers of the newest messages, in this process.
+
+    A buffer is refilled from Mongo ``ttl`` seconds after its last fill,
+    however many posts it has picked up since.
+    """
+
+    def __init__(self, fields, per_group=DEFAULT_PER_GROUP, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.fields = ('_id',) + tuple(fields)
+        self.per_group = per_group
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._buffers = OrderedDict()
+        self._loading = {}  # group_id -> docs posted while a fill was in flight
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def page(self, group_id, limit, load):
+        """The newest ``limit`` messages, oldest first, and whether older ones exist.
+
+        ``load(n)`` returns a group's newest ``n`` documents, newest first; it
+        is called on a miss. Returns None if ``limit`` exceeds the buffer.
+        """
+        if limit > self.per_group:
+            return None
+        with self._lock:
+            buffer = self._buffers.get(group_id)
+            if buffer is not None and buffer.expires_at <= time.monotonic():
+                del self._buffers[group_id]
+                self._bytes -= buffer.bytes
+                buffer = None
+            if buffer is not None:
+                self._buffers.move_to_end(group_id)
+                self.hits += 1
+                docs, has_older = list(buffer.docs), buffer.has_older
+            else:
+                self.misses += 1
+                self._loading.setdefault(group_id, [])
+
+        if buffer is None:
+            loaded = [_trim(d, self.fields) for d in load(self.per_group + 1)]
+            has_older = len(loaded) > self.per_group
+            docs = loaded[:self.per_group]
+            docs.reverse()
+            docs, has_older = self._store(group_id, docs, has_older)
+
+        return docs[-limit:], has_older or len(docs) > limit
+
+    def add(self, doc):
+        """Record a newly inserted message. Ignored for groups not buffered."""
+        group_id = doc['group_id']
+        doc = _trim(doc, self.fields)
+        with self._lock:
+            if group_id in self._loading:
+                self._loading[group_id].append(doc)
+                return
+            buffer = self._buffers.get(group_id)
+            if buffer is None:
+                return
+            before = buffer.bytes
+            self._insert(buffer, doc)
+            self._bytes += buffer.bytes - before
+            self._evict()
+
+    def invalidate(self, group_id):
+        with self._lock:
+            buffer = self._buffers.pop(group_id, None)
+            if buffer is not None:
+                self._bytes -= buffer.bytes
+            # A fill in flight for this group is discarded when it finishes
+            self._loading.pop(group_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._loading.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._buffers),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'per_group': self.per_group,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _store(self, group_id, docs, has_older):
+        buffer = _Buffer(docs, has_older, time.monotonic() + self.ttl)
+        with self._lock:
+            posted = self._loading.pop(group_id, None)
+            if posted is None:
+                # Invalidated, or another request filled it first
+                return list(buffer.docs), buffer.has_older
+            for doc in posted:
+                self._insert(buffer, doc)
+            old = self._buffers.pop(group_id, None)
+            if old is not None:
+                self._bytes -= old.bytes
+            self._buffers[group_id] = buffer
+            self._bytes += buffer.bytes
+            self._evict()
+            return list(buffer.docs), buffer.has_older
+
+    def _insert(self, buffer, doc):
+        docs = buffer.docs
+        if any(d['_id'] == doc['_id'] for d in docs):
+            return
+        if docs and len(docs) >= self.per_group and _sort_key(doc) < _sort_key(docs[0]):
+            buffer.has_older = True  # older than anything buffered
+            return
+        if not docs or _sort_key(doc) >= _sort_key(docs[-1]):
+            docs.append(doc)
+        else:
+            # Posted by another worker with a slightly earlier clock
+            insort(docs, doc, key=_sort_key)
+        buffer.bytes += _doc_size(doc)
+        while len(docs) > self.per_group:
+            buffer.bytes -= _doc_size(docs.pop(0))
+            buffer.has_older = True
+
+    def _evict(self):
+        # The most recently used group is never evicted
+        while self._bytes > self.max_bytes and len(self._buffers) > 1:
+            group_id, buffer = self._buffers.popitem(last=False)
+            self._bytes -= buffer.bytes
+            self.evictions += 1
+
+
+# Append a message to a group's list if the list is there, keep it at
+# ARGV[2] entries and mark that older messages exist once it overflows.
+# Always bumps the version key so a fill racing with the append is dropped.
+_APPEND_SCRIPT = """
+local n = redis.call('LPUSHX', KEYS[1], ARGV[1])
+if n > tonumber(ARGV[2]) then
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+    redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+end
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return n
+"""
+
+
+class RedisRecentMessages(object):
+    """Per-group buffers of the newest messages in Redis, shared by all workers.
+
+    Each group has a list of JSON documents (newest first), a flag saying
+    whether older messages exist and a version counter. Keys expire after
+    ``ttl`` seconds without a fill; configure Redis with an LRU
+    ``maxmemory-policy`` to bound memory.
+    """
+
+    def __init__(self, url, fields, per_group=DEFAULT_PER_GROUP, ttl=3600, prefix='recent:'):
+        import redis
+        from bson import json_util
+
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self._json = json_util
+        self._append = self._redis.register_script(_APPEND_SCRIPT)
+        self.fields = ('_id',) + tuple(fields)
+        self.per_group = per_group
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _keys(self, group_id):
+        base = f'{self.prefix}{group_id}'
+        return base, base + ':older', base + ':version'
+
+    def page(self, group_id, limit, load):
+        if limit > self.per_group:
+            return None
+        key, older_key, version_key = self._keys(group_id)
+        with self._redis.pipeline() as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.get(older_key)
+            raw, older = pipe.execute()
+
+        if raw:
+            self.hits += 1
+            docs = sorted((self._json.loads(r) for r in raw), key=_sort_key)
+            has_older = older == b'1'
+        else:
+            self.misses += 1
+            docs, has_older = self._fill(group_id, load)
+
+        return docs[-limit:], has_older or len(docs) > limit
+
+    def _fill(self, group_id, load):
+        key, older_key, version_key = self._keys(group_id)
+        with self._redis.pipeline() as pipe:
+            pipe.watch(version_key)
+            loaded = [_trim(d, self.fields) for d in load(self.per_group + 1)]
+            has_older = len(loaded) > self.per_group
+            docs = loaded[:self.per_group]
+            try:
+                pipe.multi()
+                pipe.delete(key)
+                if docs:
+                    pipe.rpush(key, *[self._json.dumps(d) for d in docs])
+                    pipe.expire(key, self.ttl)
+                pipe.set(older_key, '1' if has_older else '0', ex=self.ttl)
+                pipe.execute()
+            except self._watch_error:
+                pass  # a message was posted meanwhile; the next read fills again
+        docs.reverse()
+        return docs, has_older
+
+    def add(self, doc):
+        key, older_key, version_key = self._keys(doc['group_id'])
+        self._append(keys=[key, older_key, version_key],
+                     args=[self._json.dumps(_trim(doc, self.fields)), self.per_group, self.ttl])
+
+    def invalidate(self, group_id):
+        key, older_key, version_key = self._keys(group_id)
+        with self._redis.pipeline() as pipe:
+            pipe.delete(key, older_key)
+            pipe.incr(version_key)
+            pipe.expire(version_key, self.ttl)
+            pipe.execute()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'per_group': self.per_group,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+
+def create_recent_messages(kind, fields, per_group=DEFAULT_PER_GROUP, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL,
+                           redis_url=None, broker=None):
+    """Build a buffer by name: 'memory', 'redis' or 'off' (returns None).
+
+    ``broker`` is the chat broker's name. 'memory' only hears about other
+    workers' posts through a 'changestream' or 'poll' broker; with any other
+    it is turned off, with a warning.
+    """
+    if kind == 'off':
+        return None
+    if kind == 'memory':
+        if broker not in ('changestream', 'poll'):
+            logging.getLogger(__name__).warning(
+                'RECENT_MESSAGES=memory needs CHAT_BROKER=changestream or poll to see other workers\' posts; '
+                'buffering is off (use RECENT_MESSAGES=redis to share one buffer)')
+            return None
+        return RecentMessages(fields, per_group, max_bytes, ttl)
+    if kind == 'redis':
+        if not redis_url:
+            raise ValueError('RECENT_MESSAGES=redis needs REDIS_URL')
+        return RedisRecentMessages(redis_url, fields, per_group)
+    raise ValueError(f'Unknown recent message buffer: {kind}')
@@ -0,0 +1,75 @@
+"""Ranked full-text search over groups, messages and tasks.
+
+Backed by the MongoDB text indexes declared in indexes.py, which Mongo keeps
+up to date on every insert, edit and delete. Results are ranked by text
+score and paginated. Each query runs under a ``maxTimeMS`` budget so a slow
+search fails fast instead of tying up a worker.
+
+Message search covers ``db.messages`` only: messages moved into compressed
+bundles by archive.py are not indexed and drop out of the results.
+"""
+from datetime import datetime
+import time
+
+from pymongo.errors import ExecutionTimeout
+
+SCOPES = ('groups', 'messages', 'tasks')
+PAGE_SIZE = 20
+MAX_PAGE = 25  # text results cannot be keyset-paginated; cap the skip
+MAX_TIME_MS = 500
+MAX_MEMBER_GROUPS = 1000  # messages/tasks are searched within at most this many of the user's groups
+
+SCORE = {'score': {'$meta': 'textScore'}}
+
+FIELDS = {
+    'groups': {'group_name': 1, 'subject': 1, 'course_number': 1, 'description': 1},
+    'messages': {'group_id': 1, 'sender_name': 1, 'message_text': 1, 'timestamp': 1},
+    'tasks': {'group_id': 1, 'title': 1, 'description': 1, 'assigned_to': 1, 'completed': 1},
+}
+
+
+def search(db, scope, text, group_ids=None, page=1, page_size=PAGE_SIZE, max_time_ms=MAX_TIME_MS):
+    """Run one page of a ranked text search.
+
+    ``group_ids`` restricts message and task searches to those groups (it is
+    ignored for group searches, which only hide expired groups). Returns a
+    dict with ``results`` (documents with a ``score``), ``has_more``,
+    ``timed_out`` and ``took_ms``.
+    """
+    if scope not in SCOPES:
+        raise ValueError(f'Unknown search scope: {scope}')
+    page = max(1, min(page, MAX_PAGE))
+
+    query = {'$text': {'$search': text}}
+    if scope == 'groups':
+        query['$or'] = [{'expiration_date': None}, {'expiration_date': {'$gt': datetime.now()}}]
+    else:
+        query['group_id'] = {'$in': list(group_ids or [])}
+
+    projection = dict(FIELDS[scope], **SCORE)
+    cursor = (db[scope].find(query, projection)
+              .sort([('score', {'$meta': 'textScore'})])
+              .skip((page - 1) * page_size)
+              .limit(page_size + 1)
+              .max_time_ms(max_time_ms))
+
+    start = time.perf_counter()
+    timed_out = False
+    try:
+        results = list(cursor)
+    except ExecutionTimeout:
+        results = []
+        timed_out = True
+
+    return {
+        'results': results[:page_size],
+        'has_more': len(results) > page_size and page < MAX_PAGE,
+        'timed_out': timed_out,
+        'took_ms': (time.perf_counter() - start) * 1000
+    }
+
+
+def member_group_ids(db, username, limit=MAX_MEMBER_GROUPS):
+    """Ids of the groups ``username`` belongs to, most recently joined first."""
+    cursor = db.memberships.find({'username': username}, {'group_id': 1}).sort('_id', -1).limit(limit)
+    return [m['group_id'] for m in cursor]
@@ -0,0 +1,189 @@
+"""Content-addressed storage for chat attachments.
+
+Each upload is streamed to disk in chunks while it is hashed, then stored
+once under its SHA-256 digest as ``<root>/<first two hex chars>/<digest><ext>``.
+``db.blobs`` keeps one document per stored file with a reference count; a
+message holding the attachment is one reference. Files are removed when the
+last reference is released.
+
+Blob documents look like::
+
+    {'_id': '<sha256 hex>', 'ext': '.pdf', 'size': 12345,
+     'content_type': 'application/pdf', 'refcount': 3, 'created_at': datetime}
+
+Garbage collection deletes in two phases so it never removes a file that a
+concurrent upload has just put back: it first marks unreferenced blobs with
+a ``deleting`` ObjectId, removes their files and only then their documents.
+``store_upload`` does not reference a marked blob; it waits until the
+document is gone and then creates a fresh one, so its file lands after the
+old one was removed.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+CHUNK_SIZE = 64 * 1024
+# A ``deleting`` mark older than this was left by a crashed collection and
+# may be taken over
+STALE_DELETE_SECONDS = 60
+DELETE_RETRY_INTERVAL = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def blob_relpath(digest, ext):
+    """Path of a blob relative to the storage root (and to static/uploads)."""
+    return f"{digest[:2]}/{digest}{ext}"
+
+
+def blob_path(root, digest, ext):
+    return os.path.join(root, digest[:2], f"{digest}{ext}")
+
+
+def store_upload(db, root, file, ext):
+    """Store an uploaded FileStorage and add a reference to its blob.
+
+    Returns ``{'hash', 'ext', 'size'}`` for the stored blob. Uploading the same
+    content again only adds a reference.
+    """
+    ext = ext.lower()
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        hexdigest = digest.hexdigest()
+        # Reference first, file second: a concurrent garbage collection can
+        # only remove files whose blob document has no references left.
+        _add_reference(db, hexdigest, {
+            'ext': ext,
+            'size': size,
+            'content_type': file.content_type,
+            'created_at': datetime.now()
+        })
+        # Identical content, so replacing an existing copy is harmless and
+        # restores the file if it went missing.
+        final_path = blob_path(root, hexdigest, ext)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {'hash': hexdigest, 'ext': ext, 'size': size}
+
+
+def _stale_mark():
+    return ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=STALE_DELETE_SECONDS))
+
+
+def _add_reference(db, digest, meta):
+    """Add one reference to a blob, creating its document if needed.
+
+    A blob marked ``deleting`` is not touched: the upsert's filter skips it
+    and its insert collides on _id, so wait for the collection to finish (or
+    clear a stale mark) and try again.
+    """
+    while True:
+        try:
+            db.blobs.update_one(
+                {'_id': digest, 'deleting': {'$exists': False}},
+                {'$inc': {'refcount': 1}, '$setOnInsert': meta},
+                upsert=True
+            )
+            return
+        except DuplicateKeyError:
+            db.blobs.update_one({'_id': digest, 'deleting': {'$lt': _stale_mark()}}, {'$unset': {'deleting': ''}})
+            time.sleep(DELETE_RETRY_INTERVAL)
+
+
+def remove_files(paths, max_workers=1):
+    """Delete files, on a thread pool when ``max_workers`` > 1.
+
+    Missing files are ignored. Returns the number of files deleted.
+    """
+    def remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+        except Exception:
+            logger.exception('Error deleting file %s', path)
+            return 0
+
+    paths = list(paths)
+    if max_workers <= 1 or len(paths) <= 1:
+        return sum(remove(p) for p in paths)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as pool:
+        return sum(pool.map(remove, paths))
+
+
+def release_blobs(db, root, digests, max_workers=1):
+    """Drop one reference per digest (repeats allowed), then collect garbage.
+
+    Returns the number of files deleted from disk.
+    """
+    counts = Counter(d for d in digests if d)
+    if not counts:
+        return 0
+
+    db.blobs.bulk_write([
+        UpdateOne({'_id': digest}, {'$inc': {'refcount': -n}})
+        for digest, n in counts.items()
+    ], ordered=False)
+
+    return collect_garbage(db, root, list(counts), max_workers=max_workers)
+
+
+def collect_garbage(db, root, digests=None, max_workers=1):
+    """Delete unreferenced blobs (optionally only among ``digests``) from Mongo and disk.
+
+    Returns the number of files deleted from disk.
+    """
+    unreferenced = {'refcount': {'$lte': 0},
+                    '$or': [{'deleting': {'$exists': False}}, {'deleting': {'$lt': _stale_mark()}}]}
+    if digests is not None:
+        unreferenced['_id'] = {'$in': list(digests)}
+
+    candidates = [b['_id'] for b in db.blobs.find(unreferenced, {'_id': 1})]
+    if not candidates:
+        return 0
+
+    # Phase one: claim the blobs still unreferenced. From here on uploads of
+    # the same content wait instead of reviving them (see _add_reference).
+    mark = ObjectId()
+    db.blobs.update_many(dict(unreferenced, _id={'$in': candidates}), {'$set': {'deleting': mark}})
+    marked = {b['_id']: b.get('ext', '') for b in db.blobs.find({'_id': {'$in': candidates}, 'deleting': mark},
+                                                                {'ext': 1})}
+    if not marked:
+        return 0
+
+    # Phase two: files first, documents last, so a waiting upload writes its
+    # file only after the old one is gone
+    deleted = remove_files((blob_path(root, digest, ext) for digest, ext in marked.items()),
+                           max_workers=max_workers)
+    db.blobs.delete_many({'_id': {'$in': list(marked)}, 'deleting': mark, 'refcount': {'$lte': 0}})
+    # Imports reference blobs without waiting (see transfer.py); those keep
+    # their documents, and their files come with the copied upload folder
+    db.blobs.update_many({'_id': {'$in': list(marked)}, 'deleting': mark}, {'$unset': {'deleting': ''}})
+    return deleted
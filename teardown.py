@@ -0,0 +1,62 @@
+"""Bulk deletion of groups and everything that belongs to them."""
+import os
+
+from storage import release_blobs, remove_files
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def teardown_groups(db, upload_folder, group_ids, max_workers=DEFAULT_MAX_WORKERS):
+    """Delete many groups with their attachments, messages (archived too), tasks and memberships.
+
+    One query finds the attachments of all the groups, files are removed on
+    a thread pool, and each collection gets a single ``delete_many``.
+    Returns a report of what was deleted.
+    """
+    group_ids = list(group_ids)
+    report = {
+        'groups': 0,
+        'messages': 0,
+        'archived_bundles': 0,
+        'tasks': 0,
+        'memberships': 0,
+        'files_deleted': 0,
+        'blobs_released': 0
+    }
+    if not group_ids:
+        return report
+
+    in_groups = {'group_id': {'$in': group_ids}}
+    attachments = db.messages.find(
+        dict(in_groups, file_url={'$exists': True, '$ne': None}),
+        {'file_url': 1, 'file_hash': 1}
+    )
+
+    file_hashes = []
+    legacy_paths = []
+    for msg in attachments:
+        # Content-addressed attachments are shared; just drop this reference
+        if msg.get('file_hash'):
+            file_hashes.append(msg['file_hash'])
+        elif msg.get('file_url'):
+            # Older uploads live directly in the upload folder,
+            # e.g. /static/uploads/20251124_095227_Lab_11.pdf
+            legacy_paths.append(os.path.join(upload_folder, msg['file_url'].split('/')[-1]))
+
+    # Archived messages keep their attachments listed on the bundle (see archive.py)
+    for bundle in db.message_archive.find(in_groups, {'file_hashes': 1, 'file_urls': 1}):
+        file_hashes.extend(bundle.get('file_hashes', []))
+        legacy_paths.extend(os.path.join(upload_folder, url.split('/')[-1]) for url in bundle.get('file_urls', []))
+
+    report['blobs_released'] = len(file_hashes)
+    report['files_deleted'] = (
+        remove_files(legacy_paths, max_workers=max_workers) +
+        release_blobs(db, upload_folder, file_hashes, max_workers=max_workers)
+    )
+
+    report['messages'] = db.messages.delete_many(in_groups).deleted_count
+    report['archived_bundles'] = db.message_archive.delete_many(in_groups).deleted_count
+    report['tasks'] = db.tasks.delete_many(in_groups).deleted_count
+    report['memberships'] = db.memberships.delete_many(in_groups).deleted_count
+    report['groups'] = db.groups.delete_many({'_id': {'$in': group_ids}}).deleted_count
+    return report
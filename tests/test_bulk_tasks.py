@@ -0,0 +1,70 @@
+"""The all-or-nothing bulk task endpoint, /tasks/<group>/bulk."""
+from bson.objectid import ObjectId
+
+from app import MAX_BULK_TASK_OPERATIONS
+from conftest import log_in
+
+
+def bulk(client, group_id, operations):
+    return client.post(f'/tasks/{group_id}/bulk', json={'operations': operations})
+
+
+def test_create_reassign_and_delete(app, client, db, group_id):
+    bob = app.test_client()
+    log_in(bob, 'bob')
+    bob.post(f'/join/{group_id}')
+
+    created = bulk(client, group_id, [{'op': 'create', 'title': 'Read chapter 1'},
+                                      {'op': 'create', 'title': 'Practice set', 'assigned_to': 'bob'}])
+    assert created.status_code == 200
+    first, second = created.get_json()['inserted_ids']
+
+    # No toggle here: mongomock gets the $not in TOGGLE_COMPLETED's pipeline wrong
+    response = bulk(client, group_id, [{'op': 'reassign', 'id': first, 'assigned_to': 'bob'},
+                                       {'op': 'delete', 'id': second}])
+    assert response.status_code == 200
+    assert response.get_json() == {'inserted': 0, 'inserted_ids': [], 'matched': 1, 'modified': 1, 'deleted': 1}
+
+    task = db.tasks.find_one({'_id': ObjectId(first)})
+    assert task['assigned_to'] == 'bob' and task['version'] == 2
+    assert db.groups.find_one({'_id': ObjectId(group_id)})['task_count'] == 1
+
+
+def test_one_invalid_operation_rejects_the_batch(client, db, group_id):
+    response = bulk(client, group_id, [{'op': 'create', 'title': 'Fine'},
+                                       {'op': 'create', 'title': ''},
+                                       {'op': 'toggle', 'id': 'not-an-id'},
+                                       {'op': 'create', 'title': 'Help', 'assigned_to': 'mallory'},
+                                       {'op': 'create', 'title': ['not', 'text']},
+                                       {'op': 'archive'},
+                                       'create'])
+
+    assert response.status_code == 400
+    assert [e['index'] for e in response.get_json()['errors']] == [1, 2, 3, 4, 5, 6]
+    assert db.tasks.count_documents({}) == 0
+
+
+def test_operations_must_be_a_bounded_non_empty_list(client, group_id):
+    too_many = [{'op': 'create', 'title': f'Task {n}'} for n in range(MAX_BULK_TASK_OPERATIONS + 1)]
+
+    assert bulk(client, group_id, []).status_code == 400
+    assert bulk(client, group_id, {'op': 'create'}).status_code == 400
+    assert client.post(f'/tasks/{group_id}/bulk', data='nope', content_type='application/json').status_code == 400
+    assert bulk(client, group_id, too_many).status_code == 400
+
+
+def test_only_members_may_write(app, group_id):
+    outsider = app.test_client()
+    log_in(outsider, 'mallory')
+
+    assert bulk(outsider, group_id, [{'op': 'create', 'title': 'Spam'}]).status_code == 403
+
+
+def test_delete_needs_creator_or_assignee(app, client, db, group_id):
+    task_id = bulk(client, group_id, [{'op': 'create', 'title': 'Mine'}]).get_json()['inserted_ids'][0]
+    bob = app.test_client()
+    log_in(bob, 'bob')
+    bob.post(f'/join/{group_id}')
+
+    assert bulk(bob, group_id, [{'op': 'delete', 'id': task_id}]).get_json()['deleted'] == 0
+    assert db.tasks.count_documents({'_id': ObjectId(task_id)}) == 1
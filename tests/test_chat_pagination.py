@@ -0,0 +1,69 @@
+"""Keyset chat history pages that run out of hot messages and carry on into the archive."""
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from archive import archive_group
+
+
+def add_messages(db, group_id, timestamps):
+    """Insert one message per timestamp, oldest first; returns their texts."""
+    docs = [{'group_id': ObjectId(group_id), 'sender_name': 'alice', 'message_text': f'message {n}',
+             'timestamp': ts} for n, ts in enumerate(timestamps)]
+    db.messages.insert_many(docs)
+    return [d['message_text'] for d in docs]
+
+
+def all_pages(client, group_id, limit):
+    """Texts of every message reached by following next_cursor, oldest first, and the page count."""
+    texts, pages, cursor = [], 0, None
+    while True:
+        params = {'limit': limit}
+        if cursor:
+            params['before'] = cursor
+        data = client.get(f'/chat/{group_id}/messages', query_string=params).get_json()
+        texts[:0] = [m['message_text'] for m in data['messages']]
+        pages += 1
+        cursor = data['next_cursor']
+        if not cursor:
+            return texts, pages
+
+
+def test_pages_cover_hot_messages_in_order(client, db, group_id):
+    start = datetime(2025, 1, 1)
+    texts = add_messages(db, group_id, [start + timedelta(minutes=n) for n in range(7)])
+
+    assert all_pages(client, group_id, limit=3) == (texts, 3)
+
+
+def test_pages_carry_on_into_archived_messages(client, db, group_id):
+    start = datetime(2025, 1, 1)
+    texts = add_messages(db, group_id, [start + timedelta(days=n) for n in range(9)])
+    moved, bundles = archive_group(db, ObjectId(group_id), start + timedelta(days=5), batch_size=2)
+    assert (moved, bundles) == (5, 3)
+
+    assert all_pages(client, group_id, limit=4) == (texts, 3)
+
+
+def test_equal_timestamps_across_the_archive_boundary(client, db, group_id):
+    # Ties on timestamp are ordered by _id, on both sides of the boundary
+    same = datetime(2025, 1, 1)
+    texts = add_messages(db, group_id, [same] * 4 + [same + timedelta(days=1)] * 2)
+    archive_group(db, ObjectId(group_id), same + timedelta(hours=1))
+
+    assert all_pages(client, group_id, limit=1) == (texts, 6)
+    assert all_pages(client, group_id, limit=4) == (texts, 2)
+
+
+def test_only_archived_messages(client, db, group_id):
+    start = datetime(2025, 1, 1)
+    texts = add_messages(db, group_id, [start + timedelta(minutes=n) for n in range(5)])
+    archive_group(db, ObjectId(group_id), start + timedelta(days=1))
+
+    assert db.messages.count_documents({}) == 0
+    assert all_pages(client, group_id, limit=2) == (texts, 3)
+
+
+def test_bad_cursor_is_rejected(client, group_id):
+    response = client.get(f'/chat/{group_id}/messages', query_string={'before': 'yesterday_nope'})
+    assert response.status_code == 400
@@ -0,0 +1,67 @@
+"""Conditional GETs of the chat and task pages: 304 until something on the page changes."""
+from conftest import log_in
+
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={'If-None-Match': etag})
+
+
+def test_chat_page_is_not_modified_until_a_message_is_posted(client, group_id):
+    url = f'/chat/{group_id}'
+    first = client.get(url)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and etag.startswith('W/')
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    cached = revalidate(client, url, etag)
+    assert cached.status_code == 304 and cached.headers['ETag'] == etag and not cached.data
+
+    client.post(url, data={'message': 'New message'})
+    changed = revalidate(client, url, etag)
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert b'New message' in changed.data
+
+
+def test_task_page_is_not_modified_until_a_task_changes(client, group_id):
+    url = f'/tasks/{group_id}'
+    etag = client.get(url).headers['ETag']
+    assert revalidate(client, url, etag).status_code == 304
+
+    client.post(url, data={'task_title': 'Review notes'})
+    client.get(url)  # shows the "Task added" flash
+    changed = revalidate(client, url, etag)
+    assert changed.status_code == 200 and b'Review notes' in changed.data
+
+
+def test_membership_change_invalidates_the_task_page(app, client, group_id):
+    url = f'/tasks/{group_id}'
+    etag = client.get(url).headers['ETag']
+
+    bob = app.test_client()
+    log_in(bob, 'bob')
+    bob.post(f'/join/{group_id}')
+
+    assert revalidate(client, url, etag).status_code == 200
+
+
+def test_pending_flash_is_never_answered_with_304(client, group_id):
+    url = f'/chat/{group_id}'
+    etag = client.get(url).headers['ETag']
+    # Already a member: flashes a warning for the next page
+    client.post(f'/join/{group_id}')
+
+    response = revalidate(client, url, etag)
+    assert response.status_code == 200 and b'already a member' in response.data
+    assert revalidate(client, url, etag).status_code == 304
+
+
+def test_etags_are_per_user(app, client, group_id):
+    url = f'/chat/{group_id}'
+    etag = client.get(url).headers['ETag']
+
+    bob = app.test_client()
+    log_in(bob, 'bob')
+    bob.post(f'/join/{group_id}')
+    bob.get(url)
+
+    assert revalidate(bob, url, etag).status_code == 200
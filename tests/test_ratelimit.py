@@ -0,0 +1,121 @@
+"""Token buckets and concurrency slots (ratelimit.py), and their use by chat posts."""
+import io
+
+import pytest
+
+import app as app_module
+from app import services
+from ratelimit import Bucket, MemoryBackend, RateLimited, RateLimiter, per_minute
+
+
+def test_take_spends_every_bucket_or_none():
+    backend = MemoryBackend()
+    roomy = per_minute('user', 'user:alice', 10)
+    tight = per_minute('group', 'group:1', 1)
+
+    assert backend.take([roomy, tight], now=0.0) == (None, 0.0)
+    short, wait = backend.take([roomy, tight], now=0.0)
+    assert short is tight and wait == pytest.approx(60.0)
+    # The refused take left the roomy bucket alone: 9 tokens remain
+    for _ in range(9):
+        assert backend.take([roomy], now=0.0) == (None, 0.0)
+    assert backend.take([roomy], now=0.0)[0] is roomy
+
+
+def test_buckets_refill_over_time():
+    backend = MemoryBackend()
+    bucket = per_minute('user', 'user:alice', 2)
+    backend.take([bucket], now=0.0)
+    backend.take([bucket], now=0.0)
+
+    assert backend.take([bucket], now=10.0)[0] is bucket
+    assert backend.take([bucket], now=30.0) == (None, 0.0)
+
+
+def test_cost_larger_than_capacity_drains_a_full_bucket():
+    backend = MemoryBackend()
+    bucket = Bucket('upload_bytes', 'bytes:alice', 1.0, 100, 500)
+
+    assert backend.take([bucket], now=0.0) == (None, 0.0)
+    assert backend.take([bucket], now=0.0)[0] is bucket
+
+
+def test_limiter_names_the_short_bucket():
+    limiter = RateLimiter(MemoryBackend())
+    limiter.take(per_minute('ip', 'ip:1', 1))
+
+    with pytest.raises(RateLimited) as raised:
+        limiter.take(per_minute('ip', 'ip:1', 1))
+    assert raised.value.limit == 'ip' and raised.value.retry_after == 60
+
+
+def test_slots_are_held_for_the_block_only():
+    backend = MemoryBackend()
+    limiter = RateLimiter(backend)
+
+    with limiter.slot(('concurrent_uploads', 'uploads:alice', 1)):
+        with pytest.raises(RateLimited):
+            with limiter.slot(('concurrent_uploads', 'uploads:alice', 1)):
+                pass
+        assert backend.stats()['slots_in_use'] == 1
+    assert backend.stats()['slots_in_use'] == 0
+
+
+def test_refused_slot_releases_the_ones_already_held():
+    backend = MemoryBackend()
+    limiter = RateLimiter(backend)
+    backend.acquire('uploads:all', 1)
+
+    with pytest.raises(RateLimited):
+        with limiter.slot(('concurrent_uploads', 'uploads:alice', 2), ('concurrent_uploads', 'uploads:all', 1)):
+            pass
+    assert backend.stats()['slots_in_use'] == 1
+
+
+def test_memory_release_never_goes_negative():
+    backend = MemoryBackend()
+    backend.release('uploads:alice')
+
+    assert backend.acquire('uploads:alice', 1)
+    assert not backend.acquire('uploads:alice', 1)
+
+
+def test_redis_release_never_goes_negative(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    import redis
+    from ratelimit import RedisBackend
+
+    monkeypatch.setattr(redis.Redis, 'from_url', staticmethod(lambda url: fakeredis.FakeRedis()))
+    backend = RedisBackend('redis://localhost')
+    # The count expired (SLOT_TTL) while the slot was held
+    assert backend.acquire('uploads:alice', 1)
+    backend._redis.delete('ratelimit:slot:uploads:alice')
+    backend.release('uploads:alice')
+
+    assert backend.acquire('uploads:alice', 1)
+    assert not backend.acquire('uploads:alice', 1)
+
+
+def test_chat_post_refused_a_slot_keeps_its_tokens(app, client, group_id):
+    backend = MemoryBackend()
+    services(app).rate_limiter = RateLimiter(backend)
+    # Every server-wide upload slot is taken
+    for _ in range(app.config['UPLOADS_CONCURRENT']):
+        backend.acquire('uploads:all', app.config['UPLOADS_CONCURRENT'])
+
+    body = io.BytesIO(b'x' * (app_module.UPLOAD_BODY_THRESHOLD + 1))
+    response = client.post(f'/chat/{group_id}', data={'message': '', 'file': (body, 'big.txt')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 429
+    assert backend.stats()['buckets'] == 0
+
+
+def test_chat_posts_over_the_limit_get_429(app, client, group_id):
+    app.config['CHAT_POSTS_PER_MINUTE'] = 2
+    services(app).rate_limiter = RateLimiter(MemoryBackend())
+
+    statuses = [client.post(f'/chat/{group_id}', data={'message': f'hi {n}'}).status_code for n in range(3)]
+
+    assert statuses == [302, 302, 429]
@@ -0,0 +1,84 @@
+"""Blob reference counting and two-phase garbage collection (storage.py)."""
+from datetime import datetime, timedelta, timezone
+import io
+import os
+
+from bson.objectid import ObjectId
+from werkzeug.datastructures import FileStorage
+
+from storage import STALE_DELETE_SECONDS, blob_path, collect_garbage, release_blobs, store_upload
+
+
+def upload(content):
+    return FileStorage(io.BytesIO(content), filename='notes.txt', content_type='text/plain')
+
+
+def test_same_content_is_stored_once(db, tmp_path):
+    first = store_upload(db, str(tmp_path), upload(b'same'), '.TXT')
+    second = store_upload(db, str(tmp_path), upload(b'same'), '.txt')
+
+    assert first == second == {'hash': first['hash'], 'ext': '.txt', 'size': 4}
+    assert db.blobs.find_one({'_id': first['hash']})['refcount'] == 2
+    assert os.path.exists(blob_path(str(tmp_path), first['hash'], '.txt'))
+    # Only the blob; no temporary files left behind
+    assert [name for name in os.listdir(tmp_path) if name.startswith('.upload-')] == []
+
+
+def test_file_is_deleted_with_its_last_reference(db, tmp_path):
+    blob = store_upload(db, str(tmp_path), upload(b'shared'), '.txt')
+    store_upload(db, str(tmp_path), upload(b'shared'), '.txt')
+    path = blob_path(str(tmp_path), blob['hash'], '.txt')
+
+    assert release_blobs(db, str(tmp_path), [blob['hash']]) == 0
+    assert os.path.exists(path)
+
+    assert release_blobs(db, str(tmp_path), [blob['hash']]) == 1
+    assert not os.path.exists(path)
+    assert db.blobs.find_one({'_id': blob['hash']}) is None
+
+
+def test_repeated_digests_release_one_reference_each(db, tmp_path):
+    blob = store_upload(db, str(tmp_path), upload(b'twice'), '.txt')
+    store_upload(db, str(tmp_path), upload(b'twice'), '.txt')
+
+    assert release_blobs(db, str(tmp_path), [blob['hash'], blob['hash'], None]) == 1
+    assert db.blobs.find_one({'_id': blob['hash']}) is None
+
+
+def test_collection_leaves_blobs_another_collection_claimed(db, tmp_path):
+    blob = store_upload(db, str(tmp_path), upload(b'claimed'), '.txt')
+    db.blobs.update_one({'_id': blob['hash']}, {'$set': {'refcount': 0, 'deleting': ObjectId()}})
+
+    assert collect_garbage(db, str(tmp_path)) == 0
+    assert os.path.exists(blob_path(str(tmp_path), blob['hash'], '.txt'))
+
+
+def test_stale_claim_is_taken_over(db, tmp_path):
+    blob = store_upload(db, str(tmp_path), upload(b'crashed'), '.txt')
+    crashed_at = datetime.now(timezone.utc) - timedelta(seconds=2 * STALE_DELETE_SECONDS)
+    db.blobs.update_one({'_id': blob['hash']},
+                        {'$set': {'refcount': 0, 'deleting': ObjectId.from_datetime(crashed_at)}})
+
+    assert collect_garbage(db, str(tmp_path)) == 1
+    assert db.blobs.find_one({'_id': blob['hash']}) is None
+
+
+def test_upload_clears_a_stale_claim_and_keeps_the_blob(db, tmp_path):
+    blob = store_upload(db, str(tmp_path), upload(b'revived'), '.txt')
+    crashed_at = datetime.now(timezone.utc) - timedelta(seconds=2 * STALE_DELETE_SECONDS)
+    db.blobs.update_one({'_id': blob['hash']},
+                        {'$set': {'refcount': 0, 'deleting': ObjectId.from_datetime(crashed_at)}})
+
+    store_upload(db, str(tmp_path), upload(b'revived'), '.txt')
+
+    doc = db.blobs.find_one({'_id': blob['hash']})
+    assert doc['refcount'] == 1 and 'deleting' not in doc
+    assert collect_garbage(db, str(tmp_path)) == 0
+    assert os.path.exists(blob_path(str(tmp_path), blob['hash'], '.txt'))
+
+
+def test_referenced_blobs_are_not_collected(db, tmp_path):
+    blob = store_upload(db, str(tmp_path), upload(b'kept'), '.txt')
+
+    assert collect_garbage(db, str(tmp_path)) == 0
+    assert db.blobs.find_one({'_id': blob['hash']})['refcount'] == 1
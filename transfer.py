@@ -0,0 +1,256 @@
+"""Export and import of a whole group as NDJSON.
+
+An export is one JSON record per line, in MongoDB extended JSON (see
+``bson.json_util``) so ObjectIds and dates survive the round trip::
+
+    {"type": "header", "format": 1, "group_id": ..., "exported_at": ...}
+    {"type": "group", "doc": {...}}
+    {"type": "membership", "doc": {...}}     # one per member
+    {"type": "blob", "doc": {...}}           # attachment metadata, no file contents
+    {"type": "message", "doc": {...}}        # archived ones first, oldest first
+    {"type": "task", "doc": {...}}
+
+Both directions run in constant memory: the export reads batched cursors
+(and archive bundles one at a time), and the import inserts ``batch_size``
+documents at a time with ``insert_many``. Documents keep their ``_id``, so
+importing the same file twice inserts nothing new; the importer records the
+last line it has fully written in ``db.import_runs`` and a rerun resumes
+from there.
+
+Attachment files themselves are not part of an export; copy the upload
+folder alongside (files are content-addressed, see storage.py). Users are
+not exported either, since their documents hold password hashes.
+"""
+from collections import Counter
+from datetime import datetime
+import gzip
+import zlib
+
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from archive import iter_archived
+
+FORMAT_VERSION = 1
+DEFAULT_BATCH_SIZE = 1000
+DUPLICATE_KEY = 11000
+
+# record type -> collection it is imported into
+COLLECTIONS = {
+    'group': 'groups',
+    'membership': 'memberships',
+    'message': 'messages',
+    'task': 'tasks',
+}
+
+
+class ExportFormatError(ValueError):
+    """The input is not a group export this version can read."""
+
+
+def _line(record_type, doc=None, **fields):
+    record = {'type': record_type}
+    if doc is not None:
+        record['doc'] = doc
+    record.update(fields)
+    return json_util.dumps(record, json_options=json_util.RELAXED_JSON_OPTIONS) + '\n'
+
+
+def _group_file_hashes(db, group_id):
+    hashes = set(db.messages.distinct('file_hash', {'group_id': group_id, 'file_hash': {'$exists': True}}))
+    hashes.update(db.message_archive.distinct('file_hashes', {'group_id': group_id}))
+    hashes.discard(None)
+    return sorted(hashes)
+
+
+def export_group(db, group_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield a group's export, one NDJSON line at a time.
+
+    Yields nothing if the group does not exist.
+    """
+    group = db.groups.find_one({'_id': group_id})
+    if group is None:
+        return
+
+    yield _line('header', format=FORMAT_VERSION, group_id=group_id, exported_at=datetime.now())
+    yield _line('group', group)
+
+    in_group = {'group_id': group_id}
+    for doc in db.memberships.find(in_group).sort('_id', 1).batch_size(batch_size):
+        yield _line('membership', doc)
+
+    hashes = _group_file_hashes(db, group_id)
+    for start in range(0, len(hashes), batch_size):
+        blobs = db.blobs.find({'_id': {'$in': hashes[start:start + batch_size]}}, {'refcount': 0})
+        for doc in blobs:
+            yield _line('blob', doc)
+
+    for doc in iter_archived(db, group_id):
+        yield _line('message', doc)
+    messages = db.messages.find(in_group).sort([('timestamp', 1), ('_id', 1)]).batch_size(batch_size)
+    for doc in messages:
+        yield _line('message', doc)
+
+    for doc in db.tasks.find(in_group).sort('_id', 1).batch_size(batch_size):
+        yield _line('task', doc)
+
+
+def gzip_chunks(lines, level=6, chunk_size=64 * 1024):
+    """Gzip an iterable of text lines, yielding compressed chunks of about ``chunk_size``."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    pending = []
+    pending_size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= chunk_size:
+            chunk = compressor.compress(b''.join(pending))
+            pending, pending_size = [], 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(b''.join(pending)) + compressor.flush()
+
+
+def open_export(path, mode):
+    """Open an export file for text ``mode`` ('r' or 'w'); gzip if the name ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _insert(collection, docs, ordered):
+    """insert_many, skipping documents already present. Returns the inserted documents.
+
+    An ordered batch stops at a duplicate, so the rest is retried after it.
+    Any other write error is raised.
+    """
+    inserted = []
+    while docs:
+        try:
+            collection.insert_many(docs, ordered=ordered)
+            inserted.extend(docs)
+            return inserted
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(err['code'] != DUPLICATE_KEY for err in errors):
+                raise
+            failed = {err['index'] for err in errors}
+            if not ordered:
+                inserted.extend(d for i, d in enumerate(docs) if i not in failed)
+                return inserted
+            stop = min(failed)
+            inserted.extend(docs[:stop])
+            docs = docs[stop + 1:]
+    return inserted
+
+
+class _Importer(object):
+
+    def __init__(self, db, batch_size, ordered):
+        self.db = db
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.pending = {record_type: [] for record_type in COLLECTIONS}
+        self.blobs = {}
+        self.counts = Counter()
+        self.skipped = Counter()
+
+    def add(self, record_type, doc):
+        if record_type == 'blob':
+            # Written with the messages referencing them (see _insert_messages)
+            self.blobs[doc['_id']] = doc
+            return
+        if record_type not in COLLECTIONS:
+            raise ExportFormatError(f'Unknown record type: {record_type}')
+        batch = self.pending[record_type]
+        batch.append(doc)
+        if len(batch) >= self.batch_size:
+            self.flush(record_type)
+
+    def flush(self, record_type=None):
+        for name in [record_type] if record_type else list(COLLECTIONS):
+            docs, self.pending[name] = self.pending[name], []
+            if not docs:
+                continue
+            if name == 'message':
+                inserted = self._insert_messages(docs)
+            else:
+                inserted = _insert(self.db[COLLECTIONS[name]], docs, self.ordered)
+            self.counts[name] += len(inserted)
+            self.skipped[name] += len(docs) - len(inserted)
+
+    def _insert_messages(self, docs):
+        # Reference first, insert second (as in storage.store_upload): a crash
+        # in between leaves an extra reference, never a missing one.
+        refs = Counter(d['file_hash'] for d in docs if d.get('file_hash'))
+        self._add_refs(refs)
+        inserted = _insert(self.db.messages, docs, self.ordered)
+        refs.subtract(d['file_hash'] for d in inserted if d.get('file_hash'))
+        self._add_refs({digest: -n for digest, n in refs.items() if n})
+        return inserted
+
+    def _add_refs(self, refs):
+        if not refs:
+            return
+        ops = []
+        for digest, n in refs.items():
+            meta = {k: v for k, v in self.blobs.get(digest, {}).items() if k not in ('_id', 'refcount')}
+            update = {'$inc': {'refcount': n}}
+            if meta:
+                update['$setOnInsert'] = meta
+            ops.append(UpdateOne({'_id': digest}, update, upsert=n > 0))
+        self.db.blobs.bulk_write(ops, ordered=False)
+
+
+def import_group(db, lines, batch_size=DEFAULT_BATCH_SIZE, ordered=True, restart=False):
+    """Import one group's export from an iterable of NDJSON lines.
+
+    ``ordered`` inserts each batch in order and retries past duplicates;
+    unordered batches let the server insert in any order, which is faster on
+    sharded or replicated deployments. A rerun of an interrupted import skips
+    the lines the last run finished, unless ``restart``. Returns a report.
+    """
+    lines = iter(lines)
+    try:
+        header = json_util.loads(next(lines))
+    except StopIteration:
+        raise ExportFormatError('Empty export')
+    if header.get('type') != 'header' or header.get('format') != FORMAT_VERSION:
+        raise ExportFormatError('Not a StudyBuddy group export (or an unsupported format version)')
+
+    run_id = str(header['group_id'])
+    checkpoint = None if restart else db.import_runs.find_one({'_id': run_id})
+    resume_line = checkpoint['line'] if checkpoint and not checkpoint.get('completed_at') else 0
+
+    importer = _Importer(db, batch_size, ordered)
+    line_number = 1
+    for line_number, line in enumerate(lines, start=2):
+        if not line.strip():
+            continue
+        record = json_util.loads(line)
+        # Blob metadata is tiny and needed for any message, so always read it
+        if line_number <= resume_line and record['type'] != 'blob':
+            continue
+        importer.add(record['type'], record['doc'])
+        if line_number % batch_size == 0:
+            importer.flush()
+            db.import_runs.update_one(
+                {'_id': run_id},
+                {'$set': {'line': line_number, 'updated_at': datetime.now()}, '$unset': {'completed_at': ''}},
+                upsert=True
+            )
+    importer.flush()
+    db.import_runs.update_one(
+        {'_id': run_id},
+        {'$set': {'line': line_number, 'completed_at': datetime.now()}},
+        upsert=True
+    )
+
+    return {
+        'group_id': header['group_id'],
+        'inserted': dict(importer.counts),
+        'already_present': dict(importer.skipped),
+        'resumed_at_line': resume_line or None
+    }